@@ -0,0 +1,82 @@
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+
+# Stand ins for the parts of discord.py the report flow uses, they keep
+# counts of the requests that would have been made instead of sending them
+
+_ids = itertools.count(1)
+
+
+@dataclass
+class FakeStats:
+    sends: int = 0
+    edits: int = 0
+
+    @property
+    def messages(self) -> int:
+        return self.sends + self.edits
+
+
+@dataclass
+class FakeMessage:
+    id: int
+    thread: "FakeThread"
+    content: str
+
+    async def edit(self, *, content: str) -> "FakeMessage":
+        await self.thread.client.request()
+        self.thread.client.stats.edits += 1
+        self.content = content
+        return self
+
+
+@dataclass
+class FakeThread:
+    id: int
+    name: str
+    client: "FakeClient"
+
+    async def send(self, content: str) -> FakeMessage:
+        await self.client.request()
+        self.client.stats.sends += 1
+        return FakeMessage(next(_ids), self, content)
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(message_id, self, "")
+
+
+@dataclass
+class FakeMember:
+    id: int
+    display_name: str
+
+
+@dataclass
+class FakeClient:
+    # Simulated round trip for each request to discord
+    latency: float = 0
+    stats: FakeStats = field(default_factory=FakeStats)
+    members: dict[int, FakeMember] = field(default_factory=dict)
+    threads: dict[int, FakeThread] = field(default_factory=dict)
+
+    async def request(self):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    def add_member(self, user_id: int) -> tuple[FakeMember, FakeThread]:
+        member = FakeMember(user_id, f"user {user_id}")
+        thread_name = f"{member.display_name}'s adventure report"
+        thread = FakeThread(next(_ids), thread_name, self)
+        self.members[user_id] = member
+        self.threads[thread.id] = thread
+        return member, thread
+
+    def get_all_members(self) -> list[FakeMember]:
+        return list(self.members.values())
+
+    def get_member(self, user_id: int) -> FakeMember | None:
+        return self.members.get(user_id)
+
+    def get_thread(self, thread_id: int) -> FakeThread | None:
+        return self.threads.get(thread_id)
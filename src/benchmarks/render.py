@@ -0,0 +1,85 @@
+# Times how long reports take to render, with src on the path:
+#   PYTHONPATH=src python -m benchmarks.render --hours 24 --reports 20
+import argparse
+import time
+
+from game.adventure import Adventure, AdventureGroup, AdventureReport, process_adventure
+from game.groupcache import MergedGroup
+from game.quests import TICK_RATE
+from game.rendering import render_steps
+from game.skills import level_to_xp
+from game.tags import TagCollection, TagType
+
+
+def build_reports(args: argparse.Namespace) -> list[AdventureReport]:
+    reports: list[AdventureReport] = []
+    num_ticks = args.hours * 60 * 60 // TICK_RATE
+    for seed in range(args.reports):
+        player_tags = TagCollection()
+        player_tags.add_tag(
+            TagType.XP, "harvesting", level_to_xp(args.starting_level)
+        )
+        adventure = Adventure(seed, seed, args.zone, 0, seed, seed)
+        reports.extend(
+            process_adventure(
+                player_tags, adventure, num_ticks * TICK_RATE, chunk_size=num_ticks
+            )
+        )
+    return reports
+
+
+def render_report(report: AdventureReport) -> list[str]:
+    # The same work the report flow does, without storage or discord
+    messages: list[str] = []
+    merge_groups: dict[str, list[AdventureGroup]] = {}
+    for group in report.adventure_groups:
+        if group.merge:
+            merge_groups.setdefault(group.group_id, []).append(group)
+    for groups in merge_groups.values():
+        merged = MergedGroup(
+            AdventureGroup([type(step)(step.quest) for step in groups[0].steps]),
+            0,
+            None,
+            report.start_time - 1,
+        )
+        merged.add_groups(groups, report.end_time)
+        messages.append(merged.display())
+    summary = report.summarize()
+    for group in summary.adventure_groups:
+        messages.append(
+            render_steps((step.quest, step.tags_changed) for step in group.steps)
+        )
+    if summary.digest is not None:
+        messages.append(summary.digest)
+    return messages
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark report rendering")
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--zone", default="forest")
+    parser.add_argument("--starting-level", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    reports = build_reports(args)
+    groups = sum(len(report.adventure_groups) for report in reports)
+    best = float("inf")
+    messages = 0
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        messages = sum(len(render_report(report)) for report in reports)
+        best = min(best, time.perf_counter() - start)
+    print(
+        f"{len(reports)} reports of {groups // max(len(reports), 1)} groups: "
+        + f"{best / max(len(reports), 1) * 1000:.2f}ms per report "
+        + f"{groups / best:.0f} groups/s {messages} messages"
+    )
+
+
+if __name__ == "__main__":
+    main()
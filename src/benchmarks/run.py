@@ -0,0 +1,251 @@
+# Run with src on the path:
+#   PYTHONPATH=src python -m benchmarks.run --users 1000 10000 100000
+#   PYTHONPATH=src python -m benchmarks.run --save-baseline baseline.json
+#   PYTHONPATH=src python -m benchmarks.run --compare baseline.json
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+
+import reports
+from game.game import Game
+from game.quests import TICK_RATE
+from game.skills import level_to_xp
+from game.tags import TagType
+from outbox import MessageOutbox
+from storage.storagemodel import StorageTransaction
+
+from .fake_discord import FakeClient
+
+# Metrics compared against a baseline, and whether bigger numbers are better
+COMPARED_METRICS = {
+    "ticks_per_sec": True,
+    "reports_per_sec": True,
+    "db_ops_per_report": False,
+    "messages_per_report": False,
+    "p50_ms": False,
+    "p99_ms": False,
+}
+
+
+@dataclass
+class PhaseResult:
+    reports: int
+    simulated_ticks: int
+    wall_s: float
+    ticks_per_sec: float
+    reports_per_sec: float
+    db_ops_per_report: float
+    messages: int
+    messages_per_report: float
+    p50_ms: float
+    p99_ms: float
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if len(values) == 0:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace, db_path: str):
+        self.args = args
+        self.db_ops = 0
+        self.client = FakeClient(latency=args.latency)
+        self.game = Game(
+            db_path,
+            cache_size=max(args.users, 1000),
+            statement_hook=self._count_statement,
+            numpy_backend=args.numpy,
+            workers=args.workers,
+        )
+        # Delivery isn't rate limited here, only the messages are counted
+        self.outbox = MessageOutbox(
+            route_rate=1e9, route_burst=1e9, global_rate=1e9, global_burst=1e9
+        )
+        self.current_time = int(time.time())
+
+    def _count_statement(self, _: str):
+        self.db_ops += 1
+
+    async def setup(self):
+        offline_min = self.args.offline_min
+        offline_max = max(self.args.offline_max, offline_min)
+        users: list[tuple[int, int, int]] = []
+        for user_id in range(1, self.args.users + 1):
+            _, thread = self.client.add_member(user_id)
+            start_time = self.current_time - random.randint(offline_min, offline_max)
+            users.append((user_id, thread.id, start_time))
+
+        starting_xp = level_to_xp(self.args.starting_level)
+
+        def store(t: StorageTransaction):
+            for user_id, thread_id, start_time in users:
+                t.start_adventure(user_id, self.args.zone, start_time, thread_id)
+                if starting_xp > 0:
+                    t.add_remove_tag(user_id, TagType.XP, "harvesting", starting_xp)
+
+        await self.game.storage.write(store)
+        for user_id, _, _ in users:
+            self.game.scheduler.wake(user_id, self.current_time)
+
+    async def run_cycle(self, latencies: list[float]) -> tuple[int, int]:
+        report_count = 0
+        simulated_ticks = 0
+        due_users = self.game.scheduler.pop_due(self.current_time)
+        start = time.perf_counter()
+        async for report in self.game.update_adventures(due_users, self.current_time):
+            thread = self.client.get_thread(report.adventure.thread_id)
+            assert thread is not None
+            await reports.send_adventure_report(self.game, self.outbox, thread, report)
+            simulated_ticks += (report.end_time - report.start_time) // TICK_RATE
+            report_count += 1
+            # Batched work is shared, so latency is the time between reports
+            latencies.append(time.perf_counter() - start)
+            start = time.perf_counter()
+        await self.outbox.drain()
+        await self.game.flush()
+        return report_count, simulated_ticks
+
+    async def run_phase(self, cycles: int) -> PhaseResult:
+        db_ops = self.db_ops
+        messages = self.client.stats.messages
+        latencies: list[float] = []
+        report_count = 0
+        simulated_ticks = 0
+        start = time.perf_counter()
+        for cycle in range(cycles):
+            if cycle > 0:
+                self.current_time += self.args.cycle_seconds
+            cycle_reports, cycle_ticks = await self.run_cycle(latencies)
+            report_count += cycle_reports
+            simulated_ticks += cycle_ticks
+        wall_s = time.perf_counter() - start
+        messages = self.client.stats.messages - messages
+        per_report = max(report_count, 1)
+        return PhaseResult(
+            reports=report_count,
+            simulated_ticks=simulated_ticks,
+            wall_s=wall_s,
+            ticks_per_sec=simulated_ticks / wall_s,
+            reports_per_sec=report_count / wall_s,
+            db_ops_per_report=(self.db_ops - db_ops) / per_report,
+            messages=messages,
+            messages_per_report=messages / per_report,
+            p50_ms=percentile(latencies, 0.5) * 1000,
+            p99_ms=percentile(latencies, 0.99) * 1000,
+        )
+
+    async def run(self) -> dict[str, PhaseResult]:
+        await self.setup()
+        results = {"catch_up": await self.run_phase(1)}
+        if self.args.cycles > 0:
+            self.current_time += self.args.cycle_seconds
+            results["steady"] = await self.run_phase(self.args.cycles)
+        await self.game.close()
+        return results
+
+
+def compare(
+    results: dict[str, dict[str, dict[str, float]]],
+    baseline: dict[str, dict[str, dict[str, float]]],
+    tolerance: float,
+) -> list[str]:
+    regressions: list[str] = []
+    for users, phases in results.items():
+        for phase, metrics in phases.items():
+            baseline_metrics = baseline.get(users, {}).get(phase)
+            if baseline_metrics is None:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                value = metrics[metric]
+                expected = baseline_metrics[metric]
+                if higher_is_better:
+                    regressed = value < expected * (1 - tolerance)
+                else:
+                    regressed = value > expected * (1 + tolerance)
+                if regressed:
+                    regressions.append(
+                        f"{users} users {phase} {metric}: "
+                        + f"{value:.2f} vs baseline {expected:.2f}"
+                    )
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark adventure processing against a fake discord client"
+    )
+    parser.add_argument("--users", type=int, nargs="+", default=[1000])
+    parser.add_argument("--offline-min", type=int, default=0)
+    parser.add_argument("--offline-max", type=int, default=60 * 60)
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--cycle-seconds", type=int, default=2)
+    parser.add_argument("--zone", default="forest")
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--starting-level", type=int, default=0)
+    parser.add_argument("--numpy", action="store_true")
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    return parser.parse_args()
+
+
+async def run_benchmarks(args: argparse.Namespace) -> dict[str, dict[str, dict]]:
+    results: dict[str, dict[str, dict]] = {}
+    for users in args.users:
+        random.seed(args.seed)
+        user_args = argparse.Namespace(**{**vars(args), "users": users})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            benchmark = Benchmark(user_args, os.path.join(temp_dir, "game_data.db"))
+            # The report flow prints every quest, keep that out of the results
+            with open(os.devnull, "w") as devnull:
+                with contextlib.redirect_stdout(devnull):
+                    phases = await benchmark.run()
+        results[str(users)] = {
+            phase: asdict(result) for phase, result in phases.items()
+        }
+        for phase, result in phases.items():
+            print(
+                f"{users:>7} users {phase:>8}: "
+                + f"{result.ticks_per_sec:>12.0f} ticks/s "
+                + f"{result.reports_per_sec:>9.0f} reports/s "
+                + f"{result.db_ops_per_report:>7.1f} db ops/report "
+                + f"{result.messages:>7} messages "
+                + f"p50 {result.p50_ms:.2f}ms p99 {result.p99_ms:.2f}ms"
+            )
+    return results
+
+
+def main():
+    args = parse_args()
+    results = asyncio.run(run_benchmarks(args))
+
+    if args.save_baseline:
+        with open(args.save_baseline, mode="w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, mode="r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# Runs guilds split over shard processes sharing a database directory, the
+# way several bots split the gateway shards, with src on the path:
+#   PYTHONPATH=src python -m benchmarks.shards --shards 1 2 4 --guilds 8
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from multiprocessing.synchronize import Barrier
+from multiprocessing.queues import Queue
+
+import reports
+from game.game import Game
+from game.quests import TICK_RATE
+from game.skills import level_to_xp
+from game.tags import TagType
+from guilds import GuildGames
+from outbox import MessageOutbox
+from shards import ShardConfig, shard_for_guild
+from storage.storagemodel import StorageTransaction
+
+from .fake_discord import FakeClient
+from .run import percentile
+
+PHASES = ("catch_up", "steady")
+
+
+def guild_ids(args: argparse.Namespace) -> list[int]:
+    # Spread evenly over the shards, the way snowflakes mostly are
+    return [(index << 22) + 1 for index in range(args.guilds)]
+
+
+class ShardBenchmark:
+    def __init__(self, args: argparse.Namespace, shards: ShardConfig, db_dir: str):
+        self.args = args
+        self.shards = shards
+        self.owner = f"benchmark shard {shards.shard_ids[0]}"
+        self.guilds = GuildGames(self._make_game, db_dir)
+        self.clients: dict[int, FakeClient] = {}
+        self.outbox = MessageOutbox(
+            route_rate=1e9, route_burst=1e9, global_rate=1e9, global_burst=1e9
+        )
+        self.current_time = int(time.time())
+
+    def _make_game(self, db_path: str) -> Game:
+        return Game(
+            db_path,
+            cache_size=max(self.args.users, 1000),
+            numpy_backend=self.args.numpy,
+            readers=2,
+        )
+
+    async def setup(self):
+        offline_min = self.args.offline_min
+        offline_max = max(self.args.offline_max, offline_min)
+        starting_xp = level_to_xp(self.args.starting_level)
+        for guild_id in guild_ids(self.args):
+            if not self.shards.owns(guild_id):
+                continue
+            state = self.guilds.get(guild_id)
+            await state.game.acquire_lease(self.owner)
+            client = FakeClient(latency=self.args.latency)
+            self.clients[guild_id] = client
+            random.seed(self.args.seed + guild_id)
+            users: list[tuple[int, int, int]] = []
+            for user_id in range(1, self.args.users + 1):
+                _, thread = client.add_member(user_id)
+                offline = random.randint(offline_min, offline_max)
+                users.append((user_id, thread.id, self.current_time - offline))
+
+            def store(t: StorageTransaction):
+                for user_id, thread_id, start_time in users:
+                    t.start_adventure(user_id, self.args.zone, start_time, thread_id)
+                    if starting_xp > 0:
+                        t.add_remove_tag(user_id, TagType.XP, "harvesting", starting_xp)
+
+            await state.game.storage.write(store)
+            for user_id, _, _ in users:
+                state.game.scheduler.wake(user_id, self.current_time)
+
+    async def run_cycle(self, latencies: list[float]) -> tuple[int, int]:
+        report_count = 0
+        simulated_ticks = 0
+        start = time.perf_counter()
+        for state, user_ids in self.guilds.due_slices(self.current_time):
+            client = self.clients[state.guild_id]
+            async for report in state.game.update_adventures(
+                user_ids, self.current_time
+            ):
+                thread = client.get_thread(report.adventure.thread_id)
+                assert thread is not None
+                await reports.send_adventure_report(
+                    state.game, self.outbox, thread, report
+                )
+                simulated_ticks += (report.end_time - report.start_time) // TICK_RATE
+                report_count += 1
+                latencies.append(time.perf_counter() - start)
+                start = time.perf_counter()
+        await self.outbox.drain()
+        for state in self.guilds:
+            await state.game.flush()
+        return report_count, simulated_ticks
+
+    async def run_phase(self, cycles: int) -> dict[str, float]:
+        messages = sum(client.stats.messages for client in self.clients.values())
+        latencies: list[float] = []
+        report_count = 0
+        simulated_ticks = 0
+        start = time.perf_counter()
+        for cycle in range(cycles):
+            if cycle > 0:
+                self.current_time += self.args.cycle_seconds
+            cycle_reports, cycle_ticks = await self.run_cycle(latencies)
+            report_count += cycle_reports
+            simulated_ticks += cycle_ticks
+        return {
+            "reports": report_count,
+            "simulated_ticks": simulated_ticks,
+            "wall_s": time.perf_counter() - start,
+            "messages": sum(
+                client.stats.messages for client in self.clients.values()
+            )
+            - messages,
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+        }
+
+
+async def run_shard(
+    args: argparse.Namespace, shards: ShardConfig, db_dir: str, barrier: Barrier
+) -> dict[str, dict[str, float]]:
+    benchmark = ShardBenchmark(args, shards, db_dir)
+    await benchmark.setup()
+    results: dict[str, dict[str, float]] = {}
+    # Every shard starts each phase together, so their times overlap
+    barrier.wait()
+    results["catch_up"] = await benchmark.run_phase(1)
+    if args.cycles > 0:
+        benchmark.current_time += args.cycle_seconds
+        barrier.wait()
+        results["steady"] = await benchmark.run_phase(args.cycles)
+    await benchmark.guilds.close()
+    return results
+
+
+def shard_process(
+    args: argparse.Namespace,
+    shard_id: int,
+    shard_count: int,
+    db_dir: str,
+    barrier: Barrier,
+    results: Queue,
+):
+    shards = ShardConfig(shard_count, [shard_id])
+    try:
+        # The report flow prints every quest, keep that out of the results
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull):
+                shard_results = asyncio.run(run_shard(args, shards, db_dir, barrier))
+    except BaseException:
+        barrier.abort()
+        results.put((shard_id, None))
+        raise
+    results.put((shard_id, shard_results))
+
+
+def run_shards(args: argparse.Namespace, shard_count: int) -> dict[str, dict]:
+    owned = [shard_for_guild(guild_id, shard_count) for guild_id in guild_ids(args)]
+    if len(set(owned)) < shard_count:
+        raise Exception(f"{args.guilds} guilds don't cover {shard_count} shards")
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(shard_count)
+    queue = context.Queue()
+    with tempfile.TemporaryDirectory() as db_dir:
+        processes = [
+            context.Process(
+                target=shard_process,
+                args=(args, shard_id, shard_count, db_dir, barrier, queue),
+            )
+            for shard_id in range(shard_count)
+        ]
+        for process in processes:
+            process.start()
+        shard_results = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+    if any(result is None for _, result in shard_results):
+        raise Exception("A shard failed, see its traceback above")
+
+    # Shards ran side by side, so the phase took as long as the slowest one
+    phases: dict[str, dict] = {}
+    for phase in PHASES:
+        results = [result[phase] for _, result in shard_results if phase in result]
+        if len(results) == 0:
+            continue
+        wall_s = max(result["wall_s"] for result in results)
+        report_count = sum(result["reports"] for result in results)
+        simulated_ticks = sum(result["simulated_ticks"] for result in results)
+        phases[phase] = {
+            "reports": report_count,
+            "wall_s": wall_s,
+            "ticks_per_sec": simulated_ticks / wall_s,
+            "reports_per_sec": report_count / wall_s,
+            "messages": sum(result["messages"] for result in results),
+            "p50_ms": max(result["p50_ms"] for result in results),
+            "p99_ms": max(result["p99_ms"] for result in results),
+        }
+    return phases
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark guilds split over shard processes"
+    )
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--guilds", type=int, default=8)
+    parser.add_argument("--users", type=int, default=250, help="per guild")
+    parser.add_argument("--offline-min", type=int, default=0)
+    parser.add_argument("--offline-max", type=int, default=60 * 60)
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--cycle-seconds", type=int, default=2)
+    parser.add_argument("--zone", default="forest")
+    parser.add_argument("--latency", type=float, default=0.001)
+    parser.add_argument("--starting-level", type=int, default=0)
+    parser.add_argument("--numpy", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print(f"{os.cpu_count()} cpus, {args.guilds} guilds of {args.users} users")
+    baseline: dict[str, float] = {}
+    for shard_count in args.shards:
+        phases = run_shards(args, shard_count)
+        for phase, result in phases.items():
+            speedup = result["reports_per_sec"] / baseline.setdefault(
+                phase, result["reports_per_sec"]
+            )
+            print(
+                f"{shard_count:>3} shards {phase:>8}: "
+                + f"{result['ticks_per_sec']:>12.0f} ticks/s "
+                + f"{result['reports_per_sec']:>9.0f} reports/s "
+                + f"x{speedup:.2f} "
+                + f"{result['messages']:>7} messages "
+                + f"p50 {result['p50_ms']:.2f}ms p99 {result['p99_ms']:.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
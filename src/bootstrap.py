@@ -0,0 +1,61 @@
+import asyncio
+import time
+import traceback
+from collections.abc import Awaitable, Callable, Sequence
+
+from metrics import METRICS
+from outbox import TokenBucket
+
+# Setup requests are spread out so they leave room for everything else the
+# bot sends, discord also limits how quickly channels can be made
+BOOTSTRAP_CONCURRENCY = 4
+BOOTSTRAP_RATE = 2.0
+BOOTSTRAP_BURST = 5
+PROGRESS_INTERVAL = 5.0  # seconds
+
+
+class BootstrapTasks:
+    def __init__(
+        self,
+        concurrency: int = BOOTSTRAP_CONCURRENCY,
+        rate: float = BOOTSTRAP_RATE,
+        burst: float = BOOTSTRAP_BURST,
+    ):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._bucket = TokenBucket(rate, burst)
+
+    async def run(
+        self, key: str, name: str, jobs: Sequence[Callable[[], Awaitable[None]]]
+    ) -> bool:
+        # Runs every job, a few at a time, and returns whether they all
+        # succeeded so the step can be retried next time if not. The key names
+        # the step in metrics, the name in progress messages
+        if len(jobs) == 0:
+            return True
+        done = 0
+        failed = 0
+        last_progress = time.monotonic()
+
+        async def run_job(job: Callable[[], Awaitable[None]]):
+            nonlocal done, failed, last_progress
+            async with self._semaphore:
+                await self._bucket.acquire()
+                try:
+                    await job()
+                except Exception:
+                    failed += 1
+                    METRICS.count("bootstrap.failed")
+                    traceback.print_exc()
+            done += 1
+            METRICS.gauge(f"bootstrap.{key}.pending", len(jobs) - done)
+            current_time = time.monotonic()
+            if current_time >= last_progress + PROGRESS_INTERVAL:
+                last_progress = current_time
+                print(f"{name}: {done}/{len(jobs)}")
+
+        await asyncio.gather(*[run_job(job) for job in jobs])
+        if failed > 0:
+            print(f"{name}: {failed} of {len(jobs)} failed")
+        else:
+            print(f"{name}: {len(jobs)} done")
+        return failed == 0
@@ -1,12 +1,13 @@
-import random
+import math
 import time
-from collections.abc import Mapping
+from bisect import bisect_left
+from collections.abc import Iterator, Mapping
 from dataclasses import dataclass, field
 
-from .items import ITEMS
-from .quests import ROOT_QUESTS, Quest
+from .quests import TICK_RATE, ZONE_ROOT_QUESTS, Quest, RootQuest
+from .rendering import render_merged, render_step
+from .rng import CounterRng, RandomSource, derive_key
 from .tags import TagCollection, TagType
-from .zones import ZONES
 
 
 @dataclass
@@ -24,29 +25,15 @@ class AdventureStep:
         ]
 
     def display(self) -> str:
-        display_lines = []
-        for prompt in self.quest.prompts:
-            display_lines = [f"> - {prompt}  "]
-        for item_id, quantity in self.tags_changed.get_inventory(
-            TagType.ITEM
-        ).get_all_tags():
-            item = ITEMS[item_id]
-            item_name = item.name if quantity == 1 else item.plural
-            item_name = item_name.title()
-            sign = "+" if quantity >= 0 else ""
-            display_lines.append(f">     {sign}{quantity} {item_name}  ")
-        for skill_id, xp in self.tags_changed.get_inventory(TagType.XP).get_all_tags():
-            display_lines.append(f">     Gained {xp} {skill_id} xp  ")
-        for zone_id in self.get_discovered_zones():
-            zone = ZONES[zone_id]
-            display_lines.append(f">     Discovered zone: {zone.name.title()}  ")
-        return "\n".join(display_lines)
+        return render_step(self.quest, self.tags_changed)
 
 
 @dataclass
 class AdventureGroup:
     steps: list[AdventureStep]
     message_id: int | None = None
+    # Merge groups simulated in bulk stand in for this many completions
+    count: int = 1
 
     @property
     def merge(self) -> bool:
@@ -59,6 +46,12 @@ class AdventureGroup:
     def display(self) -> str: ...
 
 
+# Non merge groups a report sends as their own messages before it switches
+# to a digest, and the most quest messages a single report can send
+DIGEST_THRESHOLD = 10
+MAX_REPORT_MESSAGES = 20
+
+
 @dataclass
 class Adventure:
     adventure_id: int
@@ -66,6 +59,8 @@ class Adventure:
     zone_id: str
     last_updated: int
     thread_id: int
+    # Keys every random draw made while simulating the adventure
+    seed: int = 0
 
 
 @dataclass
@@ -74,6 +69,12 @@ class AdventureReport:
     end_time: int
     adventure_groups: list[AdventureGroup]
     adventure: Adventure
+    # Whether this is the last chunk of an update, the one that reaches the
+    # current time
+    caught_up: bool = True
+    # Shared by every chunk of one update, so the message bound holds for
+    # the whole catch up rather than each chunk
+    digest: "ReportDigest | None" = None
 
     def display(self) -> str:
         merged_steps: Mapping[str, list[AdventureStep]] = {}
@@ -91,14 +92,110 @@ class AdventureReport:
             if group_gap:
                 display_lines.append("")
         for _, steps in merged_steps.items():
-            first_step = steps[0]
-            merged_step = AdventureStep(first_step.quest)
-            for step in steps:
-                merged_step.tags_changed.add_tag_collection(step.tags_changed)
-            display_lines.append(merged_step.display())
+            display_lines.append(merge_steps(steps).display())
 
         return "\n".join(display_lines)
 
+    def summarize(
+        self,
+        digest_threshold: int = DIGEST_THRESHOLD,
+        max_messages: int = MAX_REPORT_MESSAGES,
+    ) -> "ReportSummary":
+        digest = ReportDigest(digest_threshold, max_messages)
+        return ReportSummary(digest.add(self), digest.finish())
+
+
+@dataclass
+class ReportSummary:
+    adventure_groups: list[AdventureGroup]
+    digest: str | None
+
+
+class ReportDigest:
+    # Picks the non merge groups of an update that get their own message,
+    # chunk by chunk, and folds the rest into one digest sent at the end
+    def __init__(
+        self,
+        digest_threshold: int = DIGEST_THRESHOLD,
+        max_messages: int = MAX_REPORT_MESSAGES,
+    ):
+        self.digest_threshold = min(digest_threshold, max_messages)
+        self.max_messages = max_messages
+        self.sent = 0
+        self.folding = False
+        self.seen: set[str] = set()
+        # Running totals of the folded groups, by group id
+        self.folded: dict[str, tuple[int, list[AdventureStep]]] = {}
+
+    def add(self, report: AdventureReport) -> list[AdventureGroup]:
+        normal_groups = [group for group in report.adventure_groups if not group.merge]
+        if not self.folding and self.sent + len(normal_groups) <= self.digest_threshold:
+            self.sent += len(normal_groups)
+            self.seen.update(group.group_id for group in normal_groups)
+            return normal_groups
+        self.folding = True
+
+        group_counts: dict[str, int] = {}
+        for group in normal_groups:
+            group_counts[group.group_id] = (
+                group_counts.get(group.group_id, 0) + group.count
+            )
+
+        # Quest chains seen once in the update and zone discoveries keep their
+        # own message while there is room, repeats are folded into the digest
+        separate_groups: list[AdventureGroup] = []
+        for group in normal_groups:
+            group_id = group.group_id
+            notable = (
+                group_counts[group_id] == 1 and group_id not in self.seen
+            ) or any(len(step.get_discovered_zones()) > 0 for step in group.steps)
+            if notable and self.sent < self.max_messages - 1:
+                separate_groups.append(group)
+                self.sent += 1
+                continue
+            folded = self.folded.get(group_id)
+            if folded is None:
+                steps = [AdventureStep(step.quest) for step in group.steps]
+                folded = (0, steps)
+            count, steps = folded
+            for step, group_step in zip(steps, group.steps):
+                step.tags_changed.add_tag_collection(group_step.tags_changed)
+            self.folded[group_id] = (count + group.count, steps)
+        self.seen.update(group_counts)
+        return separate_groups
+
+    def finish(self) -> str | None:
+        if len(self.folded) == 0:
+            return None
+        return "\n".join(
+            [
+                render_merged(count, [step.display() for step in steps])
+                for count, steps in self.folded.values()
+            ]
+        )
+
+
+def merge_steps(steps: list[AdventureStep]) -> AdventureStep:
+    merged_step = AdventureStep(steps[0].quest)
+    for step in steps:
+        merged_step.tags_changed.add_tag_collection(step.tags_changed)
+    return merged_step
+
+
+# Number of adventure groups process_adventure collects before yielding
+ADVENTURE_CHUNK_SIZE = 1000
+
+
+@dataclass
+class BatchedQuests:
+    # Root quests simulated ahead of time for one player's adventure window,
+    # process_adventure skips them and adds their groups to the last report
+    adventure_id: int
+    start_time: int
+    end_time: int
+    quest_ids: frozenset[str]
+    adventure_groups: list[AdventureGroup]
+
 
 @dataclass
 class QuestCompletion:
@@ -106,45 +203,185 @@ class QuestCompletion:
     next_step: int | None
 
 
-# TODO Change all rates to be based on tick rate so
-# you can speed up / slow down the game.
-TICK_RATE = 1  # One tick every 1 second
+# Fires are drawn a block of ticks at a time, keyed by the block rather than
+# by where a simulation starts, so every window sees the same fires. Blocks
+# are sized per quest to hold about this many fires.
+FIRE_BLOCK_FIRES = 16
+MIN_FIRE_BLOCK_TICKS = 64
+MAX_FIRE_BLOCK_TICKS = 1 << 20
+# How far ahead next_event_time looks before checking back in anyway
+NEXT_EVENT_SCAN_TICKS = 24 * 60 * 60 // TICK_RATE
+FIRE_STREAM = 1
+EVENT_STREAM = 2
+
+
+def ticks_until_fire(chance: float, rng: RandomSource) -> int:
+    # Geometric draw for the number of ticks before a per-tick chance succeeds
+    if chance >= 1:
+        return 0
+    return int(math.log(1.0 - rng.random()) / math.log(1.0 - chance))
+
+
+class FireSchedule:
+    # The ticks one root quest fires on for one adventure seed
+    __slots__ = (
+        "root_quest",
+        "fire_key",
+        "event_key",
+        "block_ticks",
+        "_block",
+        "_fires",
+    )
+
+    def __init__(self, root_quest: RootQuest, seed: int):
+        self.root_quest = root_quest
+        self.fire_key = derive_key(seed, FIRE_STREAM, root_quest.key)
+        # Draws for the quests each fire completes are keyed by the fire
+        self.event_key = derive_key(seed, EVENT_STREAM, root_quest.key)
+        self.block_ticks = MIN_FIRE_BLOCK_TICKS
+        if root_quest.guaranteed_fires == 0 and root_quest.fire_chance > 0:
+            while (
+                self.block_ticks < MAX_FIRE_BLOCK_TICKS
+                and self.block_ticks * root_quest.fire_chance < FIRE_BLOCK_FIRES
+            ):
+                self.block_ticks *= 2
+        self._block = -1
+        self._fires: list[tuple[int, int]] = []
+
+    def _load_block(self, block: int):
+        root_quest = self.root_quest
+        rng = CounterRng(derive_key(self.fire_key, block))
+        start_tick = block * self.block_ticks
+        end_tick = start_tick + self.block_ticks
+        fires: list[tuple[int, int]] = []
+        if root_quest.guaranteed_fires > 0:
+            for tick in range(start_tick, end_tick):
+                count = root_quest.guaranteed_fires
+                if rng.random() < root_quest.fire_chance:
+                    count += 1
+                fires.append((tick, count))
+        elif root_quest.fire_chance > 0:
+            tick = start_tick + ticks_until_fire(root_quest.fire_chance, rng)
+            while tick < end_tick:
+                fires.append((tick, 1))
+                tick += 1 + ticks_until_fire(root_quest.fire_chance, rng)
+        self._block = block
+        self._fires = fires
+
+    def can_fire(self) -> bool:
+        root_quest = self.root_quest
+        return root_quest.guaranteed_fires > 0 or root_quest.fire_chance > 0
+
+    def next_fire(self, tick: int, end_tick: int) -> tuple[int, int] | None:
+        # The first fire and its count in [tick, end_tick)
+        if not self.can_fire():
+            return None
+        block = tick // self.block_ticks
+        while block * self.block_ticks < end_tick:
+            if block != self._block:
+                self._load_block(block)
+            index = bisect_left(self._fires, (tick,))
+            if index < len(self._fires):
+                fire = self._fires[index]
+                return fire if fire[0] < end_tick else None
+            block += 1
+            tick = block * self.block_ticks
+        return None
+
+
+def next_event_time(
+    player_tags: TagCollection, adventure: Adventure, start_time: int
+) -> int | None:
+    zone_id = adventure.zone_id
+    start_tick = start_time // TICK_RATE
+    end_tick = start_tick + NEXT_EVENT_SCAN_TICKS
+    next_tick: int | None = None
+    for root_quest in ZONE_ROOT_QUESTS.get(zone_id, []):
+        if not root_quest.quest.check_quest_requirements(player_tags, zone_id):
+            continue
+        schedule = FireSchedule(root_quest, adventure.seed)
+        if not schedule.can_fire():
+            continue
+        fire = schedule.next_fire(start_tick, end_tick)
+        fire_tick = end_tick - 1 if fire is None else fire[0]
+        if next_tick is None or fire_tick < next_tick:
+            next_tick = fire_tick
+    if next_tick is None:
+        return None
+    return (next_tick + 1) * TICK_RATE
 
 
 def process_adventure(
     player_tags: TagCollection,
     adventure: Adventure,
-) -> AdventureReport:
-    current_time = int(time.time())
-    elapsed = current_time - adventure.last_updated
+    current_time: int | None = None,
+    chunk_size: int = ADVENTURE_CHUNK_SIZE,
+    batched: BatchedQuests | None = None,
+) -> Iterator[AdventureReport]:
+    # Yields the adventure as time ordered reports of about chunk_size groups,
+    # the last report always runs up to the current time even if it's empty.
+    # Every draw is keyed by the adventure's seed and the tick it happens on,
+    # so simulating a window again from the same tags gives the same results.
+    if current_time is None:
+        current_time = int(time.time())
+    start_time = adventure.last_updated
+    elapsed = current_time - start_time
     num_ticks = int(elapsed / TICK_RATE)
-    current_time = adventure.last_updated + num_ticks * TICK_RATE
+    current_time = start_time + num_ticks * TICK_RATE
+    start_tick = start_time // TICK_RATE
+    end_tick = start_tick + num_ticks
 
     zone_id = adventure.zone_id
+    root_quests = ZONE_ROOT_QUESTS.get(zone_id, [])
+    if batched is not None:
+        root_quests = [
+            root_quest
+            for root_quest in root_quests
+            if root_quest.quest.quest_id not in batched.quest_ids
+        ]
+    schedules = [
+        FireSchedule(root_quest, adventure.seed) for root_quest in root_quests
+    ]
+
+    # Rather than visiting every tick, jump straight to the earliest fire of
+    # an eligible root quest. Requirements can only change when a quest
+    # completes, so eligibility is re-checked after each event.
+    next_fires: list[tuple[int, int] | None] = [None] * len(root_quests)
+
+    def schedule_root_quests(start_tick: int, fired_tick: int | None):
+        for index, root_quest in enumerate(root_quests):
+            if not root_quest.quest.check_quest_requirements(player_tags, zone_id):
+                next_fires[index] = None
+                continue
+            next_fire = next_fires[index]
+            if next_fire is None or next_fire[0] == fired_tick:
+                next_fires[index] = schedules[index].next_fire(start_tick, end_tick)
 
     adventure_groups: list[AdventureGroup] = []
-    for _ in range(num_ticks):
-        # Try to start a new quest
-        new_quests: list[Quest] = []
-        for root_quest, frequency in ROOT_QUESTS:
-            if not root_quest.check_quest_requirements(player_tags, zone_id):
+    chunk_start_time = start_time
+    schedule_root_quests(start_tick, None)
+    while True:
+        pending_fires = [fire[0] for fire in next_fires if fire is not None]
+        if len(pending_fires) == 0:
+            break
+        tick = min(pending_fires)
+
+        new_quests: list[tuple[Quest, CounterRng]] = []
+        for index, root_quest in enumerate(root_quests):
+            next_fire = next_fires[index]
+            if next_fire is None or next_fire[0] != tick:
                 continue
-            frequency_seconds = frequency * 60
-            frequency_ticks = frequency_seconds / TICK_RATE
-            threshold = 1 / frequency_ticks if frequency_ticks > 0 else 1
-            int_threshold = int(threshold)
-            threshold -= int_threshold
-            for _ in range(int_threshold):
-                new_quests.append(root_quest)
-            if random.random() < threshold:
-                new_quests.append(root_quest)
-
-        for new_root in new_quests:
+            event_key = schedules[index].event_key
+            for fire_index in range(next_fire[1]):
+                rng = CounterRng(derive_key(event_key, tick, fire_index))
+                new_quests.append((root_quest.quest, rng))
+
+        for new_root, rng in new_quests:
             quest_queue = [new_root]
             adventure_steps: list[AdventureStep] = []
             while len(quest_queue) > 0:
                 new_quest = quest_queue.pop()
-                completed_quest = new_quest.complete_quest()
+                completed_quest = new_quest.complete_quest(rng)
                 player_tags.add_tag_collection(completed_quest.tags_changed)
                 adventure_steps.append(
                     AdventureStep(
@@ -152,7 +389,7 @@ def process_adventure(
                         tags_changed=completed_quest.tags_changed,
                     )
                 )
-                next_step = new_quest.choose_next_step(player_tags, zone_id)
+                next_step = new_quest.choose_next_step(player_tags, zone_id, rng)
                 if next_step is None:
                     continue
                 quest_queue.append(next_step)
@@ -160,8 +397,30 @@ def process_adventure(
             if len(adventure_steps) > 0:
                 adventure_groups.append(AdventureGroup(adventure_steps))
 
-    return AdventureReport(
-        adventure.last_updated,
+        schedule_root_quests(tick + 1, tick)
+
+        # Chunks are only split between ticks, and never at the very end so
+        # the last report is always the one that reaches the current time
+        if len(adventure_groups) >= chunk_size and tick + 1 < end_tick:
+            chunk_end_time = start_time + (tick + 1 - start_tick) * TICK_RATE
+            yield AdventureReport(
+                chunk_start_time,
+                chunk_end_time,
+                adventure_groups,
+                adventure,
+                caught_up=False,
+            )
+            adventure_groups = []
+            chunk_start_time = chunk_end_time
+
+    if batched is not None:
+        for adventure_group in batched.adventure_groups:
+            for step in adventure_group.steps:
+                player_tags.add_tag_collection(step.tags_changed)
+            adventure_groups.append(adventure_group)
+
+    yield AdventureReport(
+        chunk_start_time,
         current_time,
         adventure_groups,
         adventure,
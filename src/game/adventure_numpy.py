@@ -0,0 +1,182 @@
+import sys
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+
+from .adventure import Adventure, AdventureGroup, AdventureStep, BatchedQuests
+from .quests import QUESTS, TICK_RATE, ZONE_ROOT_QUESTS, Quest, RootQuest
+from .tags import TagCollection
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RNG = np.random.default_rng() if np is not None else None
+
+# Batching only pays for itself once there are a few players to share it
+BATCH_MIN_PLAYERS = 8
+
+
+@dataclass(frozen=True)
+class BatchIndex:
+    # Requirement ranges on each tag across every quest
+    requirements: Mapping[int, list[tuple[int, int]]]
+    # Tags some quest changes, and the ones some quest can take away
+    changed_tags: frozenset[int]
+    decreasing_tags: frozenset[int]
+    # Root quests that could be simulated in bulk for some players
+    candidates: Mapping[str, list[RootQuest]]
+
+
+def build_batch_index(
+    quests: Mapping[str, Quest], zone_root_quests: Mapping[str, list[RootQuest]]
+) -> BatchIndex:
+    requirements: dict[int, list[tuple[int, int]]] = {}
+    changed_tags: set[int] = set()
+    decreasing_tags: set[int] = set()
+    for quest in quests.values():
+        for tag_id, minimum, maximum in quest.requirement_ranges:
+            requirements.setdefault(tag_id, []).append((minimum, maximum))
+        for reward in quest.rewards:
+            changed_tags.add(reward.tag_id)
+            if reward.quantity[0] < 0:
+                decreasing_tags.add(reward.tag_id)
+        for tag_id, _ in quest.consumed_tags:
+            changed_tags.add(tag_id)
+            decreasing_tags.add(tag_id)
+
+    # Only merge quests that end straight away and never take anything away
+    # can be folded into a single group, chains need per player branching
+    candidates = {
+        zone_id: [
+            root_quest
+            for root_quest in root_quests
+            if root_quest.quest.merge
+            and len(root_quest.quest.next_quests) == 0
+            and len(root_quest.quest.consumed_tags) == 0
+            and all(reward.quantity[0] >= 0 for reward in root_quest.quest.rewards)
+        ]
+        for zone_id, root_quests in zone_root_quests.items()
+    }
+    return BatchIndex(
+        requirements,
+        frozenset(changed_tags),
+        frozenset(decreasing_tags),
+        candidates,
+    )
+
+
+BATCH_INDEX = build_batch_index(QUESTS, ZONE_ROOT_QUESTS)
+
+
+def batch_available() -> bool:
+    return np is not None
+
+
+def is_settled(player_tags: TagCollection, tag_id: int) -> bool:
+    # A tag is settled when no quest can change whether a requirement on it
+    # holds, so adding its rewards at the end of the window changes nothing
+    if tag_id not in BATCH_INDEX.changed_tags:
+        return True
+    if tag_id in BATCH_INDEX.decreasing_tags:
+        return False
+    quantity = player_tags.get_quantity_by_id(tag_id)
+    return all(
+        quantity >= minimum and maximum == sys.maxsize
+        for minimum, maximum in BATCH_INDEX.requirements.get(tag_id, [])
+    )
+
+
+def batchable_quests(player_tags: TagCollection, zone_id: str) -> list[RootQuest]:
+    root_quests: list[RootQuest] = []
+    for root_quest in BATCH_INDEX.candidates.get(zone_id, []):
+        quest = root_quest.quest
+        if not quest.check_quest_requirements(player_tags, zone_id):
+            continue
+        if not all(
+            is_settled(player_tags, tag_id) for tag_id, _, _ in quest.requirement_ranges
+        ):
+            continue
+        if not all(is_settled(player_tags, reward.tag_id) for reward in quest.rewards):
+            continue
+        root_quests.append(root_quest)
+    return root_quests
+
+
+def simulate_batch(
+    players: Sequence[tuple[TagCollection, Adventure]], current_time: int
+) -> list[BatchedQuests]:
+    # Fire counts and reward totals for every player's batchable quests are
+    # drawn as arrays, one pass per quest rather than one per player
+    assert np is not None
+    batches: list[BatchedQuests] = []
+    players_by_quest: dict[str, list[int]] = {}
+    root_quests: dict[str, RootQuest] = {}
+    num_ticks: list[int] = []
+    for index, (player_tags, adventure) in enumerate(players):
+        player_quests = batchable_quests(player_tags, adventure.zone_id)
+        batches.append(
+            BatchedQuests(
+                adventure.adventure_id,
+                adventure.last_updated,
+                current_time,
+                frozenset(root_quest.quest.quest_id for root_quest in player_quests),
+                [],
+            )
+        )
+        elapsed = current_time - adventure.last_updated
+        num_ticks.append(max(int(elapsed / TICK_RATE), 0))
+        for root_quest in player_quests:
+            quest_id = root_quest.quest.quest_id
+            root_quests[quest_id] = root_quest
+            players_by_quest.setdefault(quest_id, []).append(index)
+
+    ticks = np.array(num_ticks, dtype=np.int64)
+    for quest_id, indices in players_by_quest.items():
+        root_quest = root_quests[quest_id]
+        quest = root_quest.quest
+        quest_ticks = ticks[indices]
+        fires = quest_ticks * root_quest.guaranteed_fires + RNG.binomial(
+            quest_ticks, root_quest.fire_chance
+        )
+        reward_totals: list[np.ndarray] = []
+        for reward in quest.rewards:
+            hits = RNG.binomial(fires, min(reward.chance / 100, 1.0))
+            low, high = reward.quantity
+            if low == high:
+                reward_totals.append(hits * low)
+                continue
+            values = np.arange(low, high + 1)
+            counts = RNG.multinomial(hits, np.full(len(values), 1 / len(values)))
+            reward_totals.append(counts @ values)
+
+        for position, index in enumerate(indices):
+            count = int(fires[position])
+            if count == 0:
+                continue
+            tags_changed = TagCollection()
+            for reward, totals in zip(quest.rewards, reward_totals):
+                tags_changed.add_tag_by_id(reward.tag_id, int(totals[position]))
+            group = AdventureGroup([AdventureStep(quest, tags_changed)], count=count)
+            batches[index].adventure_groups.append(group)
+    return batches
+
+
+def batch_is_valid(
+    batch: BatchedQuests,
+    player_tags: TagCollection,
+    adventure: Adventure,
+    current_time: int,
+) -> bool:
+    # The player may have been updated since the batch was drawn
+    return (
+        batch.adventure_id == adventure.adventure_id
+        and batch.start_time == adventure.last_updated
+        and batch.end_time == current_time
+        and batch.quest_ids
+        == frozenset(
+            root_quest.quest.quest_id
+            for root_quest in batchable_quests(player_tags, adventure.zone_id)
+        )
+    )
+
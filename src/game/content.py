@@ -0,0 +1,123 @@
+import ast
+import glob
+import hashlib
+import os
+import pickle
+from collections.abc import Callable
+from functools import cache
+from typing import TypeVar
+
+T = TypeVar("T")
+
+# Bump when the shape of cached content changes in a way the source hash
+# below wouldn't notice
+CONTENT_CACHE_VERSION = 1
+
+DATA_DIR = os.environ.get(
+    "RPGBOT_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data"),
+)
+CACHE_DIR = os.environ.get("RPGBOT_CONTENT_CACHE", os.path.join(DATA_DIR, ".cache"))
+
+# The modules that parse content, a change to any of them or anything they
+# import from this package invalidates the cache
+CONTENT_SOURCES = ("content.py", "items.py", "zones.py", "quests.py")
+
+
+def data_path(*parts: str) -> str:
+    return os.path.join(DATA_DIR, *parts)
+
+
+def content_files() -> list[str]:
+    files: list[str] = []
+    for directory, _, names in os.walk(DATA_DIR):
+        if os.path.abspath(directory).startswith(os.path.abspath(CACHE_DIR)):
+            continue
+        for name in names:
+            if name.endswith(".yaml"):
+                files.append(os.path.join(directory, name))
+    return sorted(files)
+
+
+def content_sources(source_dir: str) -> list[str]:
+    # Follows the relative imports of the parsing modules, so helpers like the
+    # level curve baked into compiled quests are hashed too
+    sources: list[str] = []
+    pending = list(CONTENT_SOURCES)
+    while len(pending) > 0:
+        source = pending.pop()
+        if source in sources:
+            continue
+        sources.append(source)
+        with open(os.path.join(source_dir, source), mode="rb") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.level == 1 and node.module:
+                pending.append(f"{node.module.replace('.', os.sep)}.py")
+    return sorted(sources)
+
+
+@cache
+def content_hash() -> str:
+    digest = hashlib.sha256(str(CONTENT_CACHE_VERSION).encode())
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    for source in content_sources(source_dir):
+        digest.update(source.encode())
+        with open(os.path.join(source_dir, source), mode="rb") as f:
+            digest.update(f.read())
+    for path in content_files():
+        digest.update(os.path.relpath(path, DATA_DIR).encode())
+        with open(path, mode="rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def cache_path(name: str, key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{name}-{key}.pickle")
+
+
+def load_cached(name: str, build: Callable[[], T], key: str | None = None) -> T:
+    # Content is parsed and validated once per version of the data files, the
+    # result is pickled so later starts and other processes can reuse it
+    if key is None:
+        key = content_hash()
+    path = cache_path(name, key)
+    try:
+        with open(path, mode="rb") as f:
+            return pickle.load(f)
+    except Exception:
+        # Missing, truncated, or pickled by code that has changed since
+        pass
+
+    # Building reads the data files as they are now, which is only the
+    # version asked for if they haven't moved on
+    if key != content_hash():
+        content_hash.cache_clear()
+        if key != content_hash():
+            raise Exception(f"Content {key} for {name} is gone from the cache")
+    content = build()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, mode="wb") as f:
+            pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Failed to write content cache {path}: {e}")
+    return content
+
+
+def prune_cached(key: str):
+    # Bundles written before the loaded version are no longer needed. Newer
+    # ones are kept, they may belong to a reload that is still being checked
+    for name in ("items", "zones", "quests"):
+        try:
+            loaded_time = os.path.getmtime(cache_path(name, key))
+        except OSError:
+            continue
+        for path in glob.glob(os.path.join(CACHE_DIR, f"{name}-*.pickle")):
+            try:
+                if os.path.getmtime(path) < loaded_time:
+                    os.remove(path)
+            except OSError as e:
+                print(f"Failed to remove content cache {path}: {e}")
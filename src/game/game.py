@@ -1,76 +1,444 @@
-import os
+import asyncio
+import sys
 import time
+from collections.abc import AsyncIterator, Callable, Sequence
+from contextlib import AsyncExitStack, asynccontextmanager
 from math import floor
 
-from storage.storagemodel import StorageModel
+from metrics import METRICS
+from storage.asyncstorage import AsyncStorageModel
+from storage.storagemodel import StorageTransaction
 
-from .adventure import Adventure, AdventureReport, process_adventure
-from .tags import TagCollection
+from .adventure import (
+    ADVENTURE_CHUNK_SIZE,
+    AdventureReport,
+    BatchedQuests,
+    ReportDigest,
+    next_event_time,
+    process_adventure,
+)
+from .adventure_numpy import (
+    BATCH_MIN_PLAYERS,
+    batch_available,
+    batch_is_valid,
+    simulate_batch,
+)
+from .content import content_hash, prune_cached
+from .groupcache import MergedGroup, MergedGroupCache
+from .playercache import PlayerCache, PlayerState
+from .reload import (
+    CONTENT_VERSION,
+    apply_content,
+    build_content,
+    current_content_key,
+    validate_content,
+)
+from .scheduler import AdventureScheduler
+from .tags import TagCollection, TagType
+from .workers import SimulationWorkers
+
+
+# Superseded adventures are kept this long before they're compacted, their
+# messages can still be updated until then
+HISTORY_RETENTION = 7 * 24 * 60 * 60  # seconds
+COMPACTION_SLICE_SIZE = 100
+
+# Processes sharing a database hold a lease on it for this long at a time
+LEASE_DURATION = 60  # seconds
 
 
 class Game:
-    def __init__(self):
-        game_data_path = os.path.join(os.getcwd(), "game_data.db")
-        self.is_fresh = not os.path.exists(game_data_path)
-        self.storage_model = StorageModel()
-
-    def start_adventure(
-        self, user_id: int, zone_id: str, thread_id: int
-    ) -> AdventureReport | None:
-        with self.storage_model as t:
-            start_time = floor(time.time())
-            current_adventure = self.storage_model.get_current_adventure(user_id)
-            report = None
-            if current_adventure is not None:
-                report = self.update_adventure(user_id, current_adventure)
-                assert report is not None
-                # Offset end / start times for adventures to avoid overlap
-                start_time = report.end_time + 1
-            t.start_adventure(user_id, zone_id, start_time, thread_id)
-        return report
-
-    def update_adventure(
-        self, user_id: int, adventure: Adventure | None = None
-    ) -> AdventureReport | None:
-        player_tags = self.get_player_tags(user_id)
-        if adventure is None:
-            adventure = self.get_adventure_info(user_id)
-        if adventure is None:
-            return None
-        report = process_adventure(
-            player_tags=player_tags,
+    def __init__(
+        self,
+        db_path: str = "game_data.db",
+        flush_interval: float = 0.05,
+        cache_size: int = 1000,
+        statement_hook: Callable[[str], None] | None = None,
+        numpy_backend: bool = False,
+        workers: int | SimulationWorkers = 0,
+        history_retention: int = HISTORY_RETENTION,
+        readers: int = 4,
+    ):
+        self.storage = AsyncStorageModel(
+            db_path,
+            readers=readers,
+            flush_interval=flush_interval,
+            statement_hook=statement_hook,
+        )
+        self.player_cache = PlayerCache(self.storage, capacity=cache_size)
+        self.scheduler = AdventureScheduler()
+        self.numpy_backend = numpy_backend and batch_available()
+        # Simulation is moved off the event loop when there are workers, they
+        # can be shared between games and are then closed by whoever made them
+        self.workers: SimulationWorkers | None = None
+        self._owns_workers = False
+        if isinstance(workers, SimulationWorkers):
+            self.workers = workers
+        elif workers > 0:
+            self.workers = SimulationWorkers(workers)
+            self._owns_workers = True
+        # Held for each update cycle, content is only swapped between them
+        self.cycle_lock = asyncio.Lock()
+        self.history_retention = history_retention
+        self.merged_groups = MergedGroupCache()
+
+    async def flush(self):
+        METRICS.gauge("players.cached", len(self.player_cache))
+        with METRICS.timer("players.flush"):
+            await self.player_cache.flush()
+
+    async def close(self):
+        try:
+            await self.player_cache.close()
+            await self.release_lease()
+        finally:
+            self.storage.close()
+            if self.workers is not None and self._owns_workers:
+                self.workers.close()
+
+    async def acquire_lease(self, owner: str, current_time: float | None = None):
+        # Also renews it, raises if another process holds it. Every write
+        # after this checks the lease is still ours
+        if current_time is None:
+            current_time = time.time()
+        await self.storage.write(
+            lambda t: t.acquire_lease(owner, current_time, LEASE_DURATION)
+        )
+        self.storage.lease_owner = owner
+
+    async def release_lease(self):
+        owner = self.storage.lease_owner
+        if owner is None:
+            return
+        await self.storage.write(lambda t: t.release_lease(owner))
+        self.storage.lease_owner = None
+
+    @asynccontextmanager
+    async def _player_state(self, user_id: int) -> AsyncIterator[PlayerState]:
+        while True:
+            state = await self.player_cache.get(user_id)
+            async with state.lock:
+                # The player may have been evicted while waiting for the lock
+                if self.player_cache.peek(user_id) is not state:
+                    continue
+                yield state
+                return
+
+    @asynccontextmanager
+    async def _player_update(self, user_id: int) -> AsyncIterator[PlayerState]:
+        while True:
+            state = await self.player_cache.get(user_id)
+            async with state.update_lock:
+                if self.player_cache.peek(user_id) is not state:
+                    continue
+                yield state
+                return
+
+    async def start_adventure(
+        self,
+        user_id: int,
+        zone_id: str,
+        thread_id: int,
+        current_time: int | None = None,
+    ) -> AsyncIterator[AdventureReport]:
+        # Yields the rest of the current adventure before starting the new one
+        if current_time is None:
+            current_time = floor(time.time())
+        async with self._player_update(user_id) as state:
+            start_time = current_time
+            if state.adventure is not None:
+                async for report in self._stream_adventure(state, current_time):
+                    # Offset end / start times for adventures to avoid overlap
+                    start_time = report.end_time + 1
+                    yield report
+
+            async with state.lock:
+                # New adventures need an id from storage, so write through
+                changes = state.changes
+
+                def store(t: StorageTransaction):
+                    changes.store(t, user_id)
+                    return t.start_adventure(user_id, zone_id, start_time, thread_id)
+
+                state.adventure = await self.storage.write(store, urgent=True)
+                changes.clear()
+        self.scheduler.wake(user_id, start_time)
+
+    async def update_adventure(
+        self,
+        user_id: int,
+        current_time: int | None = None,
+        batched: BatchedQuests | None = None,
+    ) -> AsyncIterator[AdventureReport]:
+        async with self._player_update(user_id) as state:
+            if state.adventure is None:
+                self.scheduler.sleep(user_id)
+                return
+            async for report in self._stream_adventure(state, current_time, batched):
+                yield report
+
+    async def update_adventures(
+        self, user_ids: list[int], current_time: int | None = None
+    ) -> AsyncIterator[AdventureReport]:
+        # Updates many players at once, simple quests for all of them are
+        # drawn in one pass by the numpy backend when it's available
+        async with self.cycle_lock:
+            async for report in self._update_adventures(user_ids, current_time):
+                yield report
+
+    async def _update_adventures(
+        self, user_ids: list[int], current_time: int | None = None
+    ) -> AsyncIterator[AdventureReport]:
+        if current_time is None:
+            current_time = floor(time.time())
+        batches: dict[int, BatchedQuests] = {}
+        if self.numpy_backend and len(user_ids) >= BATCH_MIN_PLAYERS:
+            states = [await self.player_cache.get(user_id) for user_id in user_ids]
+            players = [
+                (state.tags, state.adventure)
+                for state in states
+                if state.adventure is not None
+            ]
+            with METRICS.timer("adventure.batch"):
+                for (_, adventure), batch in zip(
+                    players, simulate_batch(players, current_time)
+                ):
+                    batches[adventure.user_id] = batch
+        if self.workers is None:
+            for user_id in user_ids:
+                async for report in self.update_adventure(
+                    user_id, current_time, batches.get(user_id)
+                ):
+                    yield report
+            return
+
+        # Players are updated concurrently so every worker has work, reports
+        # are handed back as they come in with only a few waiting at a time
+        queue: asyncio.Queue[AdventureReport | None] = asyncio.Queue()
+        slots = asyncio.Semaphore(len(self.workers) * 2)
+        limit = asyncio.Semaphore(len(self.workers) * 2)
+
+        async def update(user_id: int):
+            async with limit:
+                async for report in self.update_adventure(
+                    user_id, current_time, batches.get(user_id)
+                ):
+                    await slots.acquire()
+                    queue.put_nowait(report)
+
+        async def update_all():
+            try:
+                await asyncio.gather(*[update(user_id) for user_id in user_ids])
+            finally:
+                queue.put_nowait(None)
+
+        task = asyncio.create_task(update_all())
+        try:
+            while (report := await queue.get()) is not None:
+                slots.release()
+                yield report
+            await task
+        finally:
+            task.cancel()
+
+    async def _stream_adventure(
+        self,
+        state: PlayerState,
+        current_time: int | None,
+        batched: BatchedQuests | None = None,
+    ) -> AsyncIterator[AdventureReport]:
+        assert state.adventure is not None
+        adventure = state.adventure
+        if batched is not None and (
+            current_time is None
+            or not batch_is_valid(batched, state.tags, adventure, current_time)
+        ):
+            batched = None
+        if current_time is None:
+            current_time = floor(time.time())
+        chunks = process_adventure(
+            player_tags=state.tags,
             adventure=adventure,
+            current_time=current_time,
+            batched=batched,
         )
-        with self.storage_model as t:
-            t.update_adventure(adventure.adventure_id, report.end_time)
-            for adventure_group in report.adventure_groups:
-                for adventure_step in adventure_group.steps:
-                    for (
-                        tag_type,
-                        tag,
-                        quantity,
-                    ) in adventure_step.tags_changed.get_all_tags():
-                        t.add_remove_tag(user_id, tag_type, tag, quantity)
-                        if not adventure_group.merge:
-                            continue
-                        t.update_adventure_results(
-                            adventure.adventure_id,
-                            adventure_group.group_id,
-                            adventure_step.quest.quest_id,
-                            tag_type,
-                            tag,
-                            quantity,
+        digest = ReportDigest()
+        done = False
+        while not done:
+            # The lock is only held while a chunk is simulated and stored, so
+            # the consumer can read the player back while handling each one
+            async with state.lock:
+                with METRICS.timer("adventure.process"):
+                    if self.workers is None:
+                        report = next(chunks, None)
+                        if report is None:
+                            break
+                    else:
+                        report, done = await self.workers.simulate(
+                            state.tags,
+                            adventure,
+                            current_time,
+                            ADVENTURE_CHUNK_SIZE,
+                            batched,
                         )
-                if not adventure_group.merge:
-                    continue
-                t.increment_or_insert_quest_group(
-                    adventure.adventure_id, adventure_group.group_id
+                        for group in report.adventure_groups:
+                            for step in group.steps:
+                                state.tags.add_tag_collection(step.tags_changed)
+                adventure.last_updated = report.end_time
+                state.changes.add_report(report)
+                # Long catch ups are stored as they go rather than being held
+                # in memory until the next flush
+                if len(report.adventure_groups) >= ADVENTURE_CHUNK_SIZE:
+                    await self.player_cache.store(state)
+            METRICS.count("adventure.ticks", report.end_time - report.start_time)
+            METRICS.count("adventure.groups", len(report.adventure_groups))
+            report.digest = digest
+            yield report
+        self.scheduler.reschedule(
+            state.user_id,
+            next_event_time(state.tags, adventure, adventure.last_updated),
+            adventure.last_updated,
+        )
+
+    async def compact_history(self, current_time: int | None = None) -> int:
+        # Each slice is its own small write, so player writes get in between
+        if current_time is None:
+            current_time = floor(time.time())
+        before = current_time - self.history_retention
+        # Group counts still waiting in the cache would be written to rows
+        # compaction has already merged away
+        await self.flush()
+        compacted = 0
+        while True:
+            with METRICS.timer("history.compact"):
+                count = await self.storage.write(
+                    lambda t: t.compact_adventures(before, COMPACTION_SLICE_SIZE)
+                )
+            compacted += count
+            METRICS.count("history.compacted", count)
+            if count < COMPACTION_SLICE_SIZE:
+                return compacted
+
+    async def get_active_content_ids(self) -> tuple[set[str], set[str]]:
+        # Zones and quests running adventures need, from storage and from
+        # changes that haven't been written yet
+        zone_ids, quest_ids = await self.storage.read(
+            lambda s: s.get_active_content_ids()
+        )
+        for state in self.player_cache.states():
+            if state.adventure is not None:
+                zone_ids.add(state.adventure.zone_id)
+            for _, group_id in state.changes.group_counts:
+                quest_ids.update(group_id.split(","))
+        return zone_ids, quest_ids
+
+    async def get_bot_state(self, key: str) -> str | None:
+        return await self.storage.read(lambda s: s.get_bot_state(key))
+
+    async def set_bot_state(self, key: str, value: str | None):
+        await self.storage.write(lambda t: t.set_bot_state(key, value))
+
+    async def has_adventure(self, user_id: int) -> bool:
+        state = await self.player_cache.get(user_id)
+        return state.adventure is not None
+
+    async def get_player_tags(self, user_id: int) -> TagCollection:
+        state = await self.player_cache.get(user_id)
+        return state.tags
+
+    async def add_remove_tag(
+        self, user_id: int, tag_type: TagType, tag: str, quantity: int
+    ) -> bool:
+        # Like storage, a change that would leave the tag below zero is refused
+        async with self._player_state(user_id) as state:
+            if state.tags.get_quantity(tag_type, tag) + quantity < 0:
+                return False
+            state.tags.add_tag(tag_type, tag, quantity)
+            state.changes.tags.add_tag(tag_type, tag, quantity)
+            return True
+
+    async def get_merged_group(
+        self, user_id: int, adventure_id: int, group_id: str
+    ) -> MergedGroup:
+        # Merged groups are kept up to date in memory, storage is only read
+        # back the first time a group is seen
+        merged = self.merged_groups.get(adventure_id, group_id)
+        if merged is not None:
+            return merged
+        async with self._player_state(user_id) as state:
+            merged = self.merged_groups.get(adventure_id, group_id)
+            if merged is not None:
+                return merged
+            group, (count, message_id) = await self.storage.read(
+                lambda s: (
+                    s.get_adventure_results(adventure_id, group_id),
+                    s.get_group_info(adventure_id, group_id),
+                )
+            )
+            count += state.changes.group_counts.get((adventure_id, group_id), 0)
+            for step in group.steps:
+                pending_results = state.changes.group_results.get(
+                    (adventure_id, group_id, step.quest.quest_id)
                 )
+                if pending_results is not None:
+                    step.tags_changed.add_tag_collection(pending_results)
+            # Chunks simulated since the report being sent are already read
+            # back, later reports only add what comes after them
+            through = sys.maxsize
+            if state.adventure is not None and (
+                state.adventure.adventure_id == adventure_id
+            ):
+                through = state.adventure.last_updated
+            merged = MergedGroup(group, count, message_id, through)
+            self.merged_groups.put(adventure_id, group_id, merged)
+        return merged
+
+    async def add_group_message(
+        self, adventure_id: int, group_id: str, message_id: int
+    ):
+        # Delivery of the group's later updates waits on this
+        await self.storage.write(
+            lambda t: t.add_group_message(adventure_id, group_id, message_id),
+            urgent=True,
+        )
+
 
-        return report
+async def content_changed() -> bool:
+    # Content that failed to reload isn't tried again until it changes
+    key = await asyncio.to_thread(current_content_key)
+    return key not in (CONTENT_VERSION.loaded, CONTENT_VERSION.rejected)
 
-    def get_player_tags(self, user_id: int) -> TagCollection:
-        return self.storage_model.get_player_tags(user_id=user_id)
 
-    def get_adventure_info(self, user_id: int) -> Adventure | None:
-        return self.storage_model.get_current_adventure(user_id)
+async def reload_content(games: Sequence[Game]) -> list[str]:
+    # Content is shared by every game, so it's rebuilt off the event loop and
+    # only swapped in between all of their cycles if every game's running
+    # adventures still make sense with it, returns why it wasn't
+    try:
+        content = await asyncio.to_thread(build_content)
+    except Exception as e:
+        CONTENT_VERSION.rejected = content_hash()
+        return [f"Failed to load content: {e}"]
+    async with AsyncExitStack() as stack:
+        for game in games:
+            await stack.enter_async_context(game.cycle_lock)
+        zone_ids: set[str] = set()
+        quest_ids: set[str] = set()
+        for game in games:
+            game_zone_ids, game_quest_ids = await game.get_active_content_ids()
+            zone_ids.update(game_zone_ids)
+            quest_ids.update(game_quest_ids)
+        errors = validate_content(content, zone_ids, quest_ids)
+        if len(errors) > 0:
+            CONTENT_VERSION.rejected = content.key
+            return errors
+        apply_content(content)
+        workers: dict[int, SimulationWorkers] = {}
+        for game in games:
+            # Merged groups were rendered with the old content
+            game.merged_groups.clear()
+            if game.workers is not None:
+                workers[id(game.workers)] = game.workers
+        for game_workers in workers.values():
+            game_workers.restart()
+    await asyncio.to_thread(prune_cached, content.key)
+    return []
@@ -0,0 +1,67 @@
+from collections import OrderedDict
+
+from .adventure import AdventureGroup
+from .rendering import render_merged
+
+# Merged group messages kept in memory, the least recently updated go first
+MERGED_GROUP_CACHE_SIZE = 10000
+
+
+class MergedGroup:
+    # Running totals of a merged group and the lines of its message, updated
+    # from each report rather than read back and rendered again
+    def __init__(
+        self,
+        group: AdventureGroup,
+        count: int,
+        message_id: int | None,
+        through: int,
+    ):
+        self.steps = group.steps
+        self.count = count
+        self.message_id = message_id
+        # Reports ending at or before this time are already in the totals
+        self.through = through
+        self._lines = [step.display() for step in self.steps]
+
+    def add_groups(self, groups: list[AdventureGroup], end_time: int):
+        if end_time <= self.through:
+            return
+        self.through = end_time
+        changed: set[int] = set()
+        for group in groups:
+            self.count += group.count
+            for index, step in enumerate(group.steps):
+                if len(step.tags_changed.get_all_tag_ids()) == 0:
+                    continue
+                self.steps[index].tags_changed.add_tag_collection(step.tags_changed)
+                changed.add(index)
+        for index in changed:
+            self._lines[index] = self.steps[index].display()
+
+    def display(self) -> str:
+        return render_merged(self.count, self._lines)
+
+
+class MergedGroupCache:
+    def __init__(self, capacity: int = MERGED_GROUP_CACHE_SIZE):
+        self._capacity = capacity
+        self._groups: OrderedDict[tuple[int, str], MergedGroup] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def get(self, adventure_id: int, group_id: str) -> MergedGroup | None:
+        key = (adventure_id, group_id)
+        merged = self._groups.get(key)
+        if merged is not None:
+            self._groups.move_to_end(key)
+        return merged
+
+    def put(self, adventure_id: int, group_id: str, merged: MergedGroup):
+        self._groups[(adventure_id, group_id)] = merged
+        while len(self._groups) > self._capacity:
+            self._groups.popitem(last=False)
+
+    def clear(self):
+        self._groups.clear()
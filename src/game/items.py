@@ -1,7 +1,7 @@
 from collections.abc import Mapping
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
-import yaml
+from .content import data_path, load_cached
 
 
 @dataclass
@@ -9,10 +9,20 @@ class Item:
     item_id: str
     name: str
     plural: str
+    # Names as they're shown in adventure reports
+    title: str = field(init=False)
+    plural_title: str = field(init=False)
+
+    def __post_init__(self):
+        self.title = self.name.title()
+        self.plural_title = self.plural.title()
 
 
 def load_items() -> Mapping[str, Item]:
-    with open("data/items.yaml", mode="r") as f:
+    # Only needed when the content cache is out of date
+    import yaml
+
+    with open(data_path("items.yaml"), mode="r") as f:
         item_list_yaml = yaml.safe_load(f)
     items: dict[str, Item] = {}
     for item_yaml in item_list_yaml:
@@ -26,4 +36,4 @@ def load_items() -> Mapping[str, Item]:
     return items
 
 
-ITEMS = load_items()
+ITEMS = load_cached("items", load_items)
@@ -0,0 +1,224 @@
+import asyncio
+import traceback
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from metrics import METRICS
+from storage.asyncstorage import AsyncStorageModel
+from storage.storagemodel import StorageTransaction
+
+from .adventure import Adventure, AdventureReport
+from .tags import TagCollection
+
+
+@dataclass
+class PlayerChanges:
+    tags: TagCollection = field(default_factory=TagCollection)
+    group_counts: dict[tuple[int, str], int] = field(default_factory=dict)
+    group_results: dict[tuple[int, str, str], TagCollection] = field(
+        default_factory=dict
+    )
+    adventure_times: dict[int, int] = field(default_factory=dict)
+
+    def is_empty(self) -> bool:
+        return (
+            len(self.tags.get_all_tags()) == 0
+            and len(self.group_counts) == 0
+            and len(self.group_results) == 0
+            and len(self.adventure_times) == 0
+        )
+
+    def clear(self):
+        self.tags = TagCollection()
+        self.group_counts = {}
+        self.group_results = {}
+        self.adventure_times = {}
+
+    def add_report(self, report: AdventureReport):
+        adventure_id = report.adventure.adventure_id
+        self.adventure_times[adventure_id] = report.end_time
+        for adventure_group in report.adventure_groups:
+            group_id = adventure_group.group_id
+            for adventure_step in adventure_group.steps:
+                self.tags.add_tag_collection(adventure_step.tags_changed)
+                if not adventure_group.merge:
+                    continue
+                self.get_group_results(
+                    adventure_id, group_id, adventure_step.quest.quest_id
+                ).add_tag_collection(adventure_step.tags_changed)
+            if not adventure_group.merge:
+                continue
+            group_key = (adventure_id, group_id)
+            self.group_counts[group_key] = (
+                self.group_counts.get(group_key, 0) + adventure_group.count
+            )
+
+    def get_group_results(
+        self, adventure_id: int, group_id: str, quest_id: str
+    ) -> TagCollection:
+        result_key = (adventure_id, group_id, quest_id)
+        results = self.group_results.get(result_key)
+        if results is None:
+            results = TagCollection()
+            self.group_results[result_key] = results
+        return results
+
+    def store(self, t: StorageTransaction, user_id: int):
+        for adventure_id, last_updated in self.adventure_times.items():
+            t.update_adventure(adventure_id, last_updated)
+        for tag_type, tag, quantity in self.tags.get_all_tags():
+            t.add_remove_tag(user_id, tag_type, tag, quantity)
+        for (adventure_id, group_id), count in self.group_counts.items():
+            t.increment_or_insert_quest_group(adventure_id, group_id, count)
+        for (adventure_id, group_id, quest_id), results in self.group_results.items():
+            for tag_type, tag, quantity in results.get_all_tags():
+                t.update_adventure_results(
+                    adventure_id, group_id, quest_id, tag_type, tag, quantity
+                )
+
+
+@dataclass
+class PlayerState:
+    user_id: int
+    tags: TagCollection
+    adventure: Adventure | None
+    # Changes not yet written to storage, the cached tags already include them
+    changes: PlayerChanges = field(default_factory=PlayerChanges)
+    # Held while the state is being changed or written
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Held for the whole of an adventure update, which can span several chunks
+    # and only takes the lock above while each chunk is applied
+    update_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked() or self.update_lock.locked()
+
+
+class PlayerCache:
+    def __init__(self, storage: AsyncStorageModel, capacity: int = 1000):
+        self._storage = storage
+        self._capacity = capacity
+        self._players: OrderedDict[int, PlayerState] = OrderedDict()
+        self._loading: dict[int, asyncio.Future[PlayerState]] = {}
+        self._evicting: dict[int, asyncio.Task[None]] = {}
+
+    def __len__(self) -> int:
+        return len(self._players)
+
+    def peek(self, user_id: int) -> PlayerState | None:
+        return self._players.get(user_id)
+
+    def states(self) -> list[PlayerState]:
+        return list(self._players.values())
+
+    async def get(self, user_id: int) -> PlayerState:
+        state = self._players.get(user_id)
+        if state is not None:
+            self._players.move_to_end(user_id)
+            return state
+
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = loading
+        try:
+            # Don't read the player back until their evicted state is stored
+            evicting = self._evicting.get(user_id)
+            if evicting is not None:
+                await evicting
+                # A player that failed to be stored is put back as it was
+                state = self._players.get(user_id)
+                if state is not None:
+                    loading.set_result(state)
+                    return state
+            tags, adventure = await self._storage.read(
+                lambda s: (
+                    s.get_player_tags(user_id),
+                    s.get_current_adventure(user_id),
+                )
+            )
+            state = PlayerState(user_id, tags, adventure)
+            self._players[user_id] = state
+            loading.set_result(state)
+        except BaseException as e:
+            loading.set_exception(e)
+            raise
+        finally:
+            del self._loading[user_id]
+        self._evict()
+        return state
+
+    def _evict(self):
+        for user_id, state in list(self._players.items()):
+            if len(self._players) <= self._capacity:
+                return
+            # Players that are busy are skipped, they were used too recently
+            if state.busy:
+                continue
+            del self._players[user_id]
+            if state.changes.is_empty():
+                continue
+            task = asyncio.create_task(self._store_evicted(state))
+            self._evicting[user_id] = task
+
+    async def _store_evicted(self, state: PlayerState):
+        try:
+            async with state.lock:
+                await self.store(state)
+        except Exception:
+            # Their changes are only held here, so the player goes back in the
+            # cache and the next flush tries again
+            traceback.print_exc()
+            METRICS.count("players.evict_failed")
+            if state.user_id not in self._players:
+                self._players[state.user_id] = state
+        finally:
+            del self._evicting[state.user_id]
+
+    async def store(self, state: PlayerState):
+        # Writes one player's changes through, the caller holds their lock
+        changes = state.changes
+        state.changes = PlayerChanges()
+        try:
+            await self._storage.write(
+                lambda t: changes.store(t, state.user_id), urgent=True
+            )
+        except Exception:
+            state.changes = changes
+            raise
+
+    async def flush(self):
+        # Lock every idle player with changes and store them in one write,
+        # busy players are picked up by the next flush
+        flushing: list[tuple[PlayerState, PlayerChanges]] = []
+        for state in list(self._players.values()):
+            if state.changes.is_empty() or state.lock.locked():
+                continue
+            await state.lock.acquire()
+            flushing.append((state, state.changes))
+            state.changes = PlayerChanges()
+        if len(flushing) == 0:
+            return
+
+        def store(t: StorageTransaction):
+            for state, changes in flushing:
+                changes.store(t, state.user_id)
+
+        try:
+            await self._storage.write(store)
+        except Exception:
+            # The players stayed locked, so nothing has changed since the swap
+            for state, changes in flushing:
+                state.changes = changes
+            raise
+        finally:
+            for state, _ in flushing:
+                state.lock.release()
+
+    async def close(self):
+        await self.flush()
+        for task in list(self._evicting.values()):
+            await task
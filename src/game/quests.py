@@ -1,15 +1,16 @@
 import os
 import random
+import sys
 from collections.abc import Mapping
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any
 
-import yaml
-
+from .content import data_path, load_cached
 from .skills import level_to_xp
-from .tags import TagCollection, TagType
-from .items import ITEMS
-from .zones import ZONES
+from .rng import RandomSource, name_key
+from .tags import TAG_KEYS, TagCollection, TagType, intern_tag, restore_tags
+from .items import ITEMS, Item
+from .zones import ZONES, Zone
 
 
 @dataclass(frozen=True)
@@ -18,6 +19,10 @@ class QuestRequirement:
     tag: str
     quantity: int
     consume: bool
+    tag_id: int = field(init=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "tag_id", intern_tag(self.tag_type, self.tag))
 
 
 @dataclass(frozen=True)
@@ -26,6 +31,10 @@ class QuestReward:
     tag: str
     quantity: tuple[int, int]
     chance: float
+    tag_id: int = field(init=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "tag_id", intern_tag(self.tag_type, self.tag))
 
 
 @dataclass(frozen=True)
@@ -40,6 +49,11 @@ class QuestNextStep:
     chance: float
 
 
+# TODO Change all rates to be based on tick rate so
+# you can speed up / slow down the game.
+TICK_RATE = 1  # One tick every 1 second
+
+
 @dataclass(frozen=True)
 class Quest:
     quest_id: str
@@ -50,18 +64,35 @@ class Quest:
     requirements: list[QuestRequirement]
     rewards: list[QuestReward]
     next_steps: list[QuestNextStep]
+    # Filled in by compile_quests once every quest has been loaded
+    requirement_ranges: tuple[tuple[int, int, int], ...] = field(
+        default=(), init=False, compare=False, repr=False
+    )
+    next_quests: tuple[tuple["Quest", float], ...] = field(
+        default=(), init=False, compare=False, repr=False
+    )
+    consumed_tags: tuple[tuple[int, int], ...] = field(
+        default=(), init=False, compare=False, repr=False
+    )
+    # The line reports open each step of the quest with, only the last prompt
+    # is shown
+    prompt_line: str | None = field(
+        default=None, init=False, compare=False, repr=False
+    )
+
+    def __post_init__(self):
+        if len(self.prompts) > 0:
+            object.__setattr__(self, "prompt_line", f"> - {self.prompts[-1]}  ")
 
-    def complete_quest(self) -> CompletedQuest:
+    def complete_quest(self, rng: RandomSource = random) -> CompletedQuest:
         tags_changed = TagCollection()
         for quest_reward in self.rewards:
-            if random.random() * 100 >= quest_reward.chance:
+            if rng.random() * 100 >= quest_reward.chance:
                 continue
-            quantity = random.randint(*quest_reward.quantity)
-            tags_changed.add_tag(quest_reward.tag_type, quest_reward.tag, quantity)
-        for req in self.requirements:
-            if not req.consume:
-                continue
-            tags_changed.add_tag(req.tag_type, req.tag, -req.quantity)
+            quantity = rng.randint(*quest_reward.quantity)
+            tags_changed.add_tag_by_id(quest_reward.tag_id, quantity)
+        for tag_id, quantity in self.consumed_tags:
+            tags_changed.add_tag_by_id(tag_id, quantity)
         return CompletedQuest(quest_id=self.quest_id, tags_changed=tags_changed)
 
     def check_quest_requirements(
@@ -69,47 +100,66 @@ class Quest:
     ) -> bool:
         if zone_id != self.zone_id:
             return False
-        for tag_req in self.requirements:
-            player_quantity = player_tags.get_quantity(tag_req.tag_type, tag_req.tag)
-            if tag_req.quantity == 0 and player_quantity > 0:
-                return False
-            if player_quantity < tag_req.quantity:
-                return False
-        return True
+        return player_tags.in_ranges(self.requirement_ranges)
 
     def choose_next_step(
-        self, player_tags: TagCollection, zone_id: str
+        self, player_tags: TagCollection, zone_id: str, rng: RandomSource = random
     ) -> "Quest | None":
-        for step in self.next_steps:
-            quest = QUESTS[step.quest_id]
+        for quest, chance in self.next_quests:
             if not quest.check_quest_requirements(player_tags, zone_id):
                 continue
-            if random.random() * 100 < step.chance:
+            if rng.random() * 100 < chance:
                 return quest
         return None
 
+    def compile(self, quests: Mapping[str, "Quest"]):
+        # A requirement of zero means the player must not have the tag at all
+        requirement_ranges = tuple(
+            (req.tag_id, req.quantity, 0 if req.quantity == 0 else sys.maxsize)
+            for req in self.requirements
+        )
+        consumed_tags = tuple(
+            (req.tag_id, -req.quantity) for req in self.requirements if req.consume
+        )
+        # Next steps that aren't quests, like the "No" interaction option, end
+        # the chain rather than failing the lookup mid adventure
+        next_quests = tuple(
+            (quests[step.quest_id], step.chance)
+            for step in self.next_steps
+            if step.quest_id in quests
+        )
+        object.__setattr__(self, "requirement_ranges", requirement_ranges)
+        object.__setattr__(self, "next_quests", next_quests)
+        object.__setattr__(self, "consumed_tags", consumed_tags)
+
 
 # TODO Add quest file validation to check for
 # duplicated ids, extra fields, etc...
-def parse_tag(yaml_dict: dict[str, Any]) -> tuple[TagType, str]:
+def parse_tag(
+    yaml_dict: dict[str, Any], items: Mapping[str, Item], zones: Mapping[str, Zone]
+) -> tuple[TagType, str]:
     for tag_type in TagType:
         tag = yaml_dict.get(tag_type.value)
         if tag is None:
             continue
-        if tag_type == TagType.ITEM and tag not in ITEMS:
+        if tag_type == TagType.ITEM and tag not in items:
             raise Exception(f"Invalid item_id found: {tag}")
-        if tag_type == TagType.ZONE and tag not in ZONES:
+        if tag_type == TagType.ZONE and tag not in zones:
             raise Exception(f"Invalid zone_id found: {tag}")
         return tag_type, tag
     raise Exception("Failed to parse tag type from quest yaml")
 
 
-def load_quests() -> Mapping[str, Quest]:
-    zone_dir = "data/zones"
-    files = os.listdir(zone_dir)
+def load_quests(
+    items: Mapping[str, Item] = ITEMS, zones: Mapping[str, Zone] = ZONES
+) -> Mapping[str, Quest]:
+    import yaml
+
+    zone_dir = data_path("zones")
+    files = sorted(os.listdir(zone_dir))
     quest_files: list[list[dict[str, Any]]] = []
     for file in files:
-        with open(f"{zone_dir}/{file}", mode="r") as f:
+        with open(os.path.join(zone_dir, file), mode="r") as f:
             quest_files.append(yaml.safe_load(f))
 
     quest_list_yaml = [quest for file in quest_files for quest in file]
@@ -127,7 +177,7 @@ def load_quests() -> Mapping[str, Quest]:
 
         requirements: list[QuestRequirement] = []
         for quest_requirement_yaml in quest_yaml.get("reqs", []):
-            req_tag_type, req_tag = parse_tag(quest_requirement_yaml)
+            req_tag_type, req_tag = parse_tag(quest_requirement_yaml, items, zones)
             req_quantity: int = quest_requirement_yaml.get("quantity", 1)
             if req_tag_type == TagType.LEVEL:
                 req_tag_type = TagType.XP
@@ -141,7 +191,7 @@ def load_quests() -> Mapping[str, Quest]:
         rewards: list[QuestReward] = []
         for quest_reward_yaml in quest_yaml.get("rewards", []):
             # Grab tag rewards
-            rew_tag_type, rew_tag = parse_tag(quest_reward_yaml)
+            rew_tag_type, rew_tag = parse_tag(quest_reward_yaml, items, zones)
             if rew_tag_type == TagType.LEVEL:
                 raise Exception("Cannot reward skill experience in levels")
             quantity: int | tuple[int, int] = quest_reward_yaml.get("quantity", 1)
@@ -171,12 +221,76 @@ def load_quests() -> Mapping[str, Quest]:
         if quest_id in quests:
             raise Exception(f"Duplicate quest id found: {quest_id}")
         quests[quest_id] = quest
+    compile_quests(quests)
+    return quests
+
+
+def compile_quests(quests: Mapping[str, Quest]):
+    for quest in quests.values():
+        quest.compile(quests)
+
+
+@dataclass(frozen=True)
+class RootQuest:
+    quest: Quest
+    frequency: float
+    guaranteed_fires: int
+    fire_chance: float
+    # Stable across processes, used to key the quest's random draws
+    key: int = field(init=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "key", name_key(self.quest.quest_id))
+
+
+def get_fire_threshold(frequency: float) -> tuple[int, float]:
+    frequency_seconds = frequency * 60
+    frequency_ticks = frequency_seconds / TICK_RATE
+    threshold = 1 / frequency_ticks if frequency_ticks > 0 else 1
+    int_threshold = int(threshold)
+    return int_threshold, threshold - int_threshold
+
+
+def load_root_quests(quests: Mapping[str, Quest]) -> list[tuple[Quest, float]]:
+    return [
+        (quest, quest.frequency)
+        for _, quest in quests.items()
+        if quest.frequency is not None
+    ]
+
+
+def load_zone_root_quests(
+    root_quests: list[tuple[Quest, float]]
+) -> Mapping[str, list[RootQuest]]:
+    zone_root_quests: dict[str, list[RootQuest]] = {}
+    for quest, frequency in root_quests:
+        guaranteed_fires, fire_chance = get_fire_threshold(frequency)
+        root_quest = RootQuest(quest, frequency, guaranteed_fires, fire_chance)
+        zone_root_quests.setdefault(quest.zone_id, []).append(root_quest)
+    return zone_root_quests
+
+
+def load_compiled_quests(
+    items: Mapping[str, Item] = ITEMS, zones: Mapping[str, Zone] = ZONES
+) -> tuple[Mapping[str, Quest], list[tuple[TagType, str]]]:
+    # Compiled quests hold interned tag ids, so the intern table goes with them
+    return load_quests(items, zones), list(TAG_KEYS)
+
+
+def load_quest_bundle(
+    items: Mapping[str, Item] = ITEMS,
+    zones: Mapping[str, Zone] = ZONES,
+    key: str | None = None,
+) -> Mapping[str, Quest]:
+    quests, tag_keys = load_cached(
+        "quests", lambda: load_compiled_quests(items, zones), key
+    )
+    if not restore_tags(tag_keys):
+        # Something was interned differently before the bundle was loaded
+        return load_quests(items, zones)
     return quests
 
 
-QUESTS = load_quests()
-ROOT_QUESTS = [
-    (quest, quest.frequency)
-    for _, quest in QUESTS.items()
-    if quest.frequency is not None
-]
+QUESTS = load_quest_bundle()
+ROOT_QUESTS = load_root_quests(QUESTS)
+ZONE_ROOT_QUESTS = load_zone_root_quests(ROOT_QUESTS)
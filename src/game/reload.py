@@ -0,0 +1,95 @@
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from typing import TypeVar
+
+from . import adventure_numpy
+from .adventure_numpy import build_batch_index
+from .content import content_hash, load_cached
+from .items import ITEMS, Item, load_items
+from .quests import (
+    QUESTS,
+    ROOT_QUESTS,
+    ZONE_ROOT_QUESTS,
+    Quest,
+    load_quest_bundle,
+    load_root_quests,
+    load_zone_root_quests,
+)
+from .zones import ZONES, Zone, load_zones
+
+T = TypeVar("T")
+
+
+@dataclass
+class ContentVersion:
+    # The version of the data files that's loaded, and the last one that
+    # failed to load
+    loaded: str
+    rejected: str | None = None
+
+
+CONTENT_VERSION = ContentVersion(content_hash())
+
+
+@dataclass
+class Content:
+    key: str
+    items: Mapping[str, Item]
+    zones: Mapping[str, Zone]
+    quests: Mapping[str, Quest]
+
+
+def current_content_key() -> str:
+    # Rehashes the data files, they may have changed since the last check
+    content_hash.cache_clear()
+    return content_hash()
+
+
+def build_content(key: str | None = None) -> Content:
+    # Safe to run on another thread, nothing in use is touched until the new
+    # content is applied. A given key loads that version from the cache
+    if key is None:
+        key = current_content_key()
+    items = load_cached("items", load_items, key)
+    zones = load_cached("zones", load_zones, key)
+    quests = load_quest_bundle(items, zones, key)
+    return Content(key, items, zones, quests)
+
+
+def validate_content(
+    content: Content, zone_ids: Iterable[str], quest_ids: Iterable[str]
+) -> list[str]:
+    # Running adventures and the groups already reported for them have to
+    # resolve against the new content
+    errors: list[str] = []
+    for zone_id in sorted(set(zone_ids)):
+        if zone_id not in content.zones:
+            errors.append(f"Zone {zone_id} has running adventures")
+    for quest_id in sorted(set(quest_ids)):
+        if quest_id not in content.quests:
+            errors.append(f"Quest {quest_id} is part of a running adventure")
+    return errors
+
+
+def replace_table(table: Mapping[str, T], new_table: Mapping[str, T]):
+    assert isinstance(table, dict)
+    table.clear()
+    table.update(new_table)
+
+
+def apply_content(content: Content):
+    # The tables are imported by name all over, so they're replaced in place.
+    # Nothing here yields to the event loop, so no update sees half of it
+    replace_table(ITEMS, content.items)
+    replace_table(ZONES, content.zones)
+    replace_table(QUESTS, content.quests)
+    ROOT_QUESTS[:] = load_root_quests(QUESTS)
+    replace_table(ZONE_ROOT_QUESTS, load_zone_root_quests(ROOT_QUESTS))
+    adventure_numpy.BATCH_INDEX = build_batch_index(QUESTS, ZONE_ROOT_QUESTS)
+    CONTENT_VERSION.loaded = content.key
+
+
+def load_content_version(key: str):
+    # Brings a worker process in line with the content its parent is using
+    if CONTENT_VERSION.loaded != key:
+        apply_content(build_content(key))
@@ -0,0 +1,49 @@
+from collections.abc import Iterable
+
+from .items import ITEMS
+from .quests import Quest
+from .tags import TAG_KEYS, TagCollection, TagType
+from .zones import ZONES
+
+# Message bodies are built in one pass over the changed tags, the names they
+# use are worked out once when content is loaded
+
+
+def render_step(quest: Quest, tags_changed: TagCollection) -> str:
+    # Items come first, then xp and discovered zones
+    lines: list[str] = [] if quest.prompt_line is None else [quest.prompt_line]
+    xp_lines: list[str] = []
+    zone_lines: list[str] = []
+    for tag_id, quantity in tags_changed.get_all_tag_ids():
+        tag_type, tag = TAG_KEYS[tag_id]
+        if tag_type is TagType.ITEM:
+            item = ITEMS[tag]
+            name = item.title if quantity == 1 else item.plural_title
+            lines.append(f">     {quantity:+} {name}  ")
+        elif tag_type is TagType.XP:
+            xp_lines.append(f">     Gained {quantity} {tag} xp  ")
+        elif tag_type is TagType.ZONE and quantity >= 1:
+            zone_lines.append(f">     Discovered zone: {ZONES[tag].title}  ")
+    lines += xp_lines
+    lines += zone_lines
+    return "\n".join(lines)
+
+
+def render_steps(steps: Iterable[tuple[Quest, TagCollection]]) -> str:
+    return "\n".join(
+        [render_step(quest, tags_changed) for quest, tags_changed in steps]
+    )
+
+
+def render_merged(count: int, step_lines: Iterable[str]) -> str:
+    return "\n".join([f"x{count}:", *step_lines])
+
+
+def render_inventory(player_tags: TagCollection) -> str:
+    lines: list[str] = []
+    for tag_id, quantity in player_tags.get_all_tag_ids():
+        tag_type, tag = TAG_KEYS[tag_id]
+        # Used up items keep their entry in memory, storage drops them
+        if tag_type is TagType.ITEM and quantity > 0:
+            lines.append(f"    {quantity}x {ITEMS[tag].name}")
+    return "Inventory: \n" + "\n".join(lines)
@@ -0,0 +1,55 @@
+import zlib
+from typing import Protocol
+
+# Counter based random numbers, every draw is a pure function of a key built
+# from the adventure's seed and where in the adventure the draw is made, so
+# any part of an adventure can be simulated again and give the same results
+
+MASK = (1 << 64) - 1
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+DOUBLE_UNIT = 1.0 / (1 << 53)
+
+
+def mix(value: int) -> int:
+    # The splitmix64 finaliser
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK
+    return value ^ (value >> 31)
+
+
+def derive_key(key: int, *values: int) -> int:
+    for value in values:
+        key = mix(((key ^ value) + GOLDEN_GAMMA) & MASK)
+    return key
+
+
+def name_key(name: str) -> int:
+    # Python's str hash is salted per process, crc32 is the same everywhere
+    return zlib.crc32(name.encode())
+
+
+class RandomSource(Protocol):
+    def random(self) -> float: ...
+
+    def randint(self, a: int, b: int) -> int: ...
+
+
+class CounterRng:
+    # A splitmix64 stream starting from a derived key, supports the parts of
+    # the random module the simulation uses
+    __slots__ = ("_state",)
+
+    def __init__(self, key: int):
+        self._state = key & MASK
+
+    def next64(self) -> int:
+        self._state = value = (self._state + GOLDEN_GAMMA) & MASK
+        value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+        value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK
+        return value ^ (value >> 31)
+
+    def random(self) -> float:
+        return (self.next64() >> 11) * DOUBLE_UNIT
+
+    def randint(self, a: int, b: int) -> int:
+        return a + self.next64() % (b - a + 1)
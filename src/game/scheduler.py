@@ -0,0 +1,68 @@
+import heapq
+
+# Don't wake a user more often than this, so short bursts of events
+# still end up batched into one report.
+MIN_WAKE_DELAY = 2  # seconds
+
+
+class AdventureScheduler:
+    def __init__(self):
+        self._heap: list[tuple[float, int]] = []
+        self._due_times: dict[int, float] = {}
+        self._sleeping: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._due_times)
+
+    def is_sleeping(self, user_id: int) -> bool:
+        return user_id in self._sleeping
+
+    def schedule(self, user_id: int, due_time: float):
+        if user_id in self._sleeping:
+            return
+        current_due_time = self._due_times.get(user_id)
+        if current_due_time is not None and current_due_time <= due_time:
+            return
+        self._due_times[user_id] = due_time
+        heapq.heappush(self._heap, (due_time, user_id))
+
+    def reschedule(self, user_id: int, due_time: float | None, current_time: float):
+        # Replaces any pending wake up, a due time of None means nothing can
+        # happen on the adventure until something else wakes the user
+        self._due_times.pop(user_id, None)
+        if due_time is None:
+            return
+        self.schedule(user_id, max(due_time, current_time + MIN_WAKE_DELAY))
+
+    def wake(self, user_id: int, current_time: float):
+        self._sleeping.discard(user_id)
+        self.schedule(user_id, current_time)
+
+    def sleep(self, user_id: int):
+        self._sleeping.add(user_id)
+        self._due_times.pop(user_id, None)
+
+    def next_due_time(self) -> float | None:
+        self._discard_stale()
+        if len(self._heap) == 0:
+            return None
+        return self._heap[0][0]
+
+    def pop_due(self, current_time: float, limit: int | None = None) -> list[int]:
+        due_users: list[int] = []
+        while limit is None or len(due_users) < limit:
+            self._discard_stale()
+            if len(self._heap) == 0 or self._heap[0][0] > current_time:
+                break
+            _, user_id = heapq.heappop(self._heap)
+            del self._due_times[user_id]
+            due_users.append(user_id)
+        return due_users
+
+    def _discard_stale(self):
+        # Entries are removed lazily, skip any that were rescheduled or slept
+        while len(self._heap) > 0:
+            due_time, user_id = self._heap[0]
+            if self._due_times.get(user_id) == due_time:
+                return
+            heapq.heappop(self._heap)
@@ -1,4 +1,5 @@
-from dataclasses import dataclass, field
+import threading
+from collections.abc import ItemsView
 from enum import Enum
 
 
@@ -10,74 +11,149 @@ class TagType(Enum):
     LEVEL = "level"
 
 
-@dataclass
+# Every (tag type, tag) pair is interned to a small integer the first time it
+# is seen, quests intern theirs when they're loaded
+TAG_IDS: dict[tuple[TagType, str], int] = {}
+TAG_KEYS: list[tuple[TagType, str]] = []
+# Content can be reloaded on another thread while the game interns tags
+_INTERN_LOCK = threading.Lock()
+
+
+def intern_tag(tag_type: TagType, tag: str) -> int:
+    key = (tag_type, tag)
+    tag_id = TAG_IDS.get(key)
+    if tag_id is None:
+        with _INTERN_LOCK:
+            tag_id = TAG_IDS.get(key)
+            if tag_id is None:
+                tag_id = len(TAG_KEYS)
+                TAG_KEYS.append(key)
+                TAG_IDS[key] = tag_id
+    return tag_id
+
+
+def restore_tags(tag_keys: list[tuple[TagType, str]]) -> bool:
+    # Interns a saved table, only works while this one agrees with it so far
+    for tag_id, (tag_type, tag) in enumerate(tag_keys):
+        if intern_tag(tag_type, tag) != tag_id:
+            return False
+    return True
+
+
 class Inventory:
-    _tags: dict[str, int] = field(default_factory=dict)
+    # A view of the tags of one type in a collection
+    __slots__ = ("_collection", "_tag_type")
+
+    def __init__(
+        self,
+        collection: "TagCollection | None" = None,
+        tag_type: TagType = TagType.TAG,
+    ):
+        self._collection = collection if collection is not None else TagCollection()
+        self._tag_type = tag_type
 
     def get_quantity(self, tag: str) -> int:
-        return self._tags.get(tag, 0)
+        return self._collection.get_quantity(self._tag_type, tag)
 
     def add_tag(self, tag: str, quantity: int):
-        if quantity == 0:
-            return
-        if tag not in self._tags:
-            self._tags[tag] = quantity
-            return
-        self._tags[tag] += quantity
+        self._collection.add_tag(self._tag_type, tag, quantity)
 
     def add_inventory(self, inventory: "Inventory"):
-        for tag, quantity in inventory._tags.items():
+        for tag, quantity in inventory.get_all_tags():
             self.add_tag(tag, quantity)
 
     def remove_inventory(self, inventory: "Inventory") -> bool:
-        for tag, quantity in inventory._tags.items():
-            if not self.add_tag(tag, -quantity):
+        tags = inventory.get_all_tags()
+        for tag, quantity in tags:
+            if self.get_quantity(tag) < quantity:
                 return False
+        for tag, quantity in tags:
+            self.add_tag(tag, -quantity)
         return True
 
     def get_all_tags(self) -> list[tuple[str, int]]:
-        return list(self._tags.items())
+        return [
+            (TAG_KEYS[tag_id][1], quantity)
+            for tag_id, quantity in self._collection._quantities.items()
+            if TAG_KEYS[tag_id][0] == self._tag_type
+        ]
 
 
-@dataclass
 class TagCollection:
-    _inventories: dict[TagType, Inventory] = field(default_factory=dict)
+    # Quantities keyed by interned tag id, tags added and later taken back
+    # down to zero keep their entry like the old per type dictionaries did
+    __slots__ = ("_quantities",)
+
+    def __init__(self):
+        self._quantities: dict[int, int] = {}
 
     def get_inventory(self, tag_type: TagType) -> Inventory:
-        inventory = self._inventories.get(tag_type)
-        if inventory is None:
-            inventory = Inventory()
-            self._inventories[tag_type] = inventory
-        return inventory
+        return Inventory(self, tag_type)
 
     def get_quantity(self, tag_type: TagType, tag: str) -> int:
-        return self.get_inventory(tag_type).get_quantity(tag)
+        tag_id = TAG_IDS.get((tag_type, tag))
+        if tag_id is None:
+            return 0
+        return self._quantities.get(tag_id, 0)
+
+    def get_quantity_by_id(self, tag_id: int) -> int:
+        return self._quantities.get(tag_id, 0)
+
+    def in_ranges(self, ranges: tuple[tuple[int, int, int], ...]) -> bool:
+        # Ranges are (tag id, minimum, maximum) triples, all must hold
+        quantities = self._quantities
+        for tag_id, minimum, maximum in ranges:
+            quantity = quantities.get(tag_id, 0)
+            if quantity < minimum or quantity > maximum:
+                return False
+        return True
 
     def add_tag(self, tag_type: TagType, tag: str, quantity: int):
-        inventory = self.get_inventory(tag_type)
-        inventory.add_tag(tag, quantity)
+        if quantity == 0:
+            return
+        self.add_tag_by_id(intern_tag(tag_type, tag), quantity)
+
+    def add_tag_by_id(self, tag_id: int, quantity: int):
+        if quantity == 0:
+            return
+        quantities = self._quantities
+        quantities[tag_id] = quantities.get(tag_id, 0) + quantity
 
     def add_inventory(self, tag_type: TagType, inventory: Inventory):
-        current_inventory = self.get_inventory(tag_type)
-        current_inventory.add_inventory(inventory)
+        self.get_inventory(tag_type).add_inventory(inventory)
 
     def remove_inventory(self, tag_type: TagType, inventory: Inventory) -> bool:
-        current_inventory = self.get_inventory(tag_type)
-        return current_inventory.remove_inventory(inventory)
+        return self.get_inventory(tag_type).remove_inventory(inventory)
 
     def add_tag_collection(self, other: "TagCollection"):
-        for tag_type, inventory in other._inventories.items():
-            self.add_inventory(tag_type, inventory)
+        quantities = self._quantities
+        for tag_id, quantity in other._quantities.items():
+            if quantity == 0:
+                continue
+            quantities[tag_id] = quantities.get(tag_id, 0) + quantity
 
     def remove_tag_collection(self, other: "TagCollection") -> bool:
-        for tag_type, inventory in other._inventories.items():
-            if not self.remove_inventory(tag_type, inventory):
+        quantities = self._quantities
+        for tag_id, quantity in other._quantities.items():
+            if quantities.get(tag_id, 0) < quantity:
                 return False
+        for tag_id, quantity in other._quantities.items():
+            self.add_tag_by_id(tag_id, -quantity)
         return True
 
+    def get_all_tag_ids(self) -> ItemsView[int, int]:
+        return self._quantities.items()
+
     def get_all_tags(self) -> list[tuple[TagType, str, int]]:
         return [
-            (tag_type, tag, quantity)
-            for tag_type, inventory in self._inventories.items()
-            for tag, quantity in inventory.get_all_tags()
+            (*TAG_KEYS[tag_id], quantity)
+            for tag_id, quantity in self._quantities.items()
         ]
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, TagCollection):
+            return NotImplemented
+        return self._quantities == other._quantities
+
+    def __repr__(self) -> str:
+        return f"TagCollection({self.get_all_tags()})"
@@ -0,0 +1,196 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import forkserver
+
+from metrics import METRICS
+
+from .adventure import (
+    Adventure,
+    AdventureGroup,
+    AdventureReport,
+    AdventureStep,
+    BatchedQuests,
+    process_adventure,
+)
+from .quests import QUESTS, TICK_RATE
+from .reload import CONTENT_VERSION, load_content_version
+from .tags import TagCollection, TagType
+
+# Workers aren't forked from the bot, which by then runs storage threads.
+# The fork server imports the content once when it can, so workers start
+# quickly and only swap in content that was reloaded since
+if "forkserver" in multiprocessing.get_all_start_methods():
+    WORKER_CONTEXT = multiprocessing.get_context("forkserver")
+    WORKER_CONTEXT.set_forkserver_preload([__name__])
+else:
+    WORKER_CONTEXT = multiprocessing.get_context("spawn")
+
+# Tag ids are interned separately in every process, so tags cross between
+# processes by name as (tag type, tag, quantity) tuples
+PackedTags = tuple[tuple[str, str, int], ...]
+# Quest ids, the tags changed by each step and the group's count
+PackedGroup = tuple[tuple[str, ...], tuple[PackedTags, ...], int]
+PackedBatch = tuple[int, int, int, tuple[str, ...], tuple[PackedGroup, ...]]
+# Start and end time, the groups and whether the adventure is caught up
+PackedChunk = tuple[int, int, tuple[PackedGroup, ...], bool]
+
+
+def pack_tags(tags: TagCollection) -> PackedTags:
+    return tuple(
+        (tag_type.value, tag, quantity)
+        for tag_type, tag, quantity in tags.get_all_tags()
+    )
+
+
+def unpack_tags(packed: PackedTags) -> TagCollection:
+    tags = TagCollection()
+    for tag_type, tag, quantity in packed:
+        tags.add_tag(TagType(tag_type), tag, quantity)
+    return tags
+
+
+def pack_groups(groups: list[AdventureGroup]) -> tuple[PackedGroup, ...]:
+    return tuple(
+        (
+            tuple(step.quest.quest_id for step in group.steps),
+            tuple(pack_tags(step.tags_changed) for step in group.steps),
+            group.count,
+        )
+        for group in groups
+    )
+
+
+def unpack_groups(packed: tuple[PackedGroup, ...]) -> list[AdventureGroup]:
+    return [
+        AdventureGroup(
+            [
+                AdventureStep(QUESTS[quest_id], unpack_tags(tags_changed))
+                for quest_id, tags_changed in zip(quest_ids, step_tags)
+            ],
+            count=count,
+        )
+        for quest_ids, step_tags, count in packed
+    ]
+
+
+def pack_batch(batched: BatchedQuests | None) -> PackedBatch | None:
+    if batched is None:
+        return None
+    return (
+        batched.adventure_id,
+        batched.start_time,
+        batched.end_time,
+        tuple(batched.quest_ids),
+        pack_groups(batched.adventure_groups),
+    )
+
+
+def unpack_batch(packed: PackedBatch | None) -> BatchedQuests | None:
+    if packed is None:
+        return None
+    adventure_id, start_time, end_time, quest_ids, groups = packed
+    return BatchedQuests(
+        adventure_id, start_time, end_time, frozenset(quest_ids), unpack_groups(groups)
+    )
+
+
+def simulate_chunk(
+    packed_tags: PackedTags,
+    adventure: Adventure,
+    current_time: int,
+    chunk_size: int,
+    packed_batch: PackedBatch | None,
+) -> PackedChunk:
+    # Runs in a worker process, only the first chunk is simulated and the
+    # caller comes back for the next one from where this one ended
+    chunks = process_adventure(
+        unpack_tags(packed_tags),
+        adventure,
+        current_time,
+        chunk_size,
+        unpack_batch(packed_batch),
+    )
+    report = next(chunks)
+    num_ticks = int((current_time - adventure.last_updated) / TICK_RATE)
+    done = report.end_time == adventure.last_updated + num_ticks * TICK_RATE
+    return (
+        report.start_time,
+        report.end_time,
+        pack_groups(report.adventure_groups),
+        done,
+    )
+
+
+class SimulationWorkers:
+    def __init__(self, processes: int):
+        # One single process executor per shard, so a player's chunks always
+        # run in order on the same worker
+        if WORKER_CONTEXT.get_start_method() == "forkserver":
+            forkserver.ensure_running()
+        self._executors = [self._start_executor() for _ in range(processes)]
+
+    def _start_executor(self) -> ProcessPoolExecutor:
+        # Workers load the content this process is using from the cache. They
+        # import the bot again as they start, so they're started right away
+        # while the data files still match what was loaded
+        executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=WORKER_CONTEXT,
+            initializer=load_content_version,
+            initargs=(CONTENT_VERSION.loaded,),
+        )
+        executor.submit(load_content_version, CONTENT_VERSION.loaded)
+        return executor
+
+    def restart(self):
+        # Workers hold their own copy of the content, new ones pick up the
+        # current content while chunks already sent finish on the old ones
+        old_executors = self._executors
+        self._executors = [self._start_executor() for _ in old_executors]
+        for executor in old_executors:
+            executor.shutdown(wait=False)
+
+    def __len__(self) -> int:
+        return len(self._executors)
+
+    async def simulate(
+        self,
+        player_tags: TagCollection,
+        adventure: Adventure,
+        current_time: int,
+        chunk_size: int,
+        batched: BatchedQuests | None = None,
+    ) -> tuple[AdventureReport, bool]:
+        shard = adventure.user_id % len(self._executors)
+        executor = self._executors[shard]
+        loop = asyncio.get_running_loop()
+        args = (
+            pack_tags(player_tags),
+            adventure,
+            current_time,
+            chunk_size,
+            pack_batch(batched),
+        )
+        try:
+            start_time, end_time, groups, done = await loop.run_in_executor(
+                executor, simulate_chunk, *args
+            )
+        except BrokenProcessPool:
+            # The worker died, the shard gets a new one for the chunks after
+            # this. The chunk that was lost is simulated here instead, in
+            # case it's what took the worker down
+            METRICS.count("workers.broken")
+            if self._executors[shard] is executor:
+                self._executors[shard] = self._start_executor()
+                executor.shutdown(wait=False)
+            start_time, end_time, groups, done = simulate_chunk(*args)
+        report = AdventureReport(
+            start_time, end_time, unpack_groups(groups), adventure, caught_up=done
+        )
+        return report, done
+
+    def close(self):
+        for executor in self._executors:
+            executor.shutdown()
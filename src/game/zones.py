@@ -1,7 +1,7 @@
 from collections.abc import Mapping
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
-import yaml
+from .content import data_path, load_cached
 
 
 @dataclass
@@ -10,10 +10,16 @@ class Zone:
     name: str
     description: str
     public: bool
+    title: str = field(init=False)
+
+    def __post_init__(self):
+        self.title = self.name.title()
 
 
 def load_zones() -> Mapping[str, Zone]:
-    with open("data/zones.yaml", mode="r") as f:
+    import yaml
+
+    with open(data_path("zones.yaml"), mode="r") as f:
         zone_list_yaml = yaml.safe_load(f)
     zones: dict[str, Zone] = {}
     for zone_yaml in zone_list_yaml:
@@ -26,4 +32,4 @@ def load_zones() -> Mapping[str, Zone]:
     return zones
 
 
-ZONES = load_zones()
+ZONES = load_cached("zones", load_zones)
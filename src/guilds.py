@@ -0,0 +1,112 @@
+import asyncio
+import os
+import traceback
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+
+from game.game import Game
+from game.zones import Zone
+
+# The guild the bot was first run in keeps the database it has always used
+LEGACY_GUILD_ID = 1229078590713364602
+LEGACY_DB_NAME = "game_data.db"
+
+# Due players are updated this many at a time from each guild in turn
+GUILD_SLICE_SIZE = 100
+
+
+def guild_db_path(db_dir: str, guild_id: int) -> str:
+    if guild_id == LEGACY_GUILD_ID:
+        return os.path.join(db_dir, LEGACY_DB_NAME)
+    return os.path.join(db_dir, f"game_data_{guild_id}.db")
+
+
+@dataclass
+class GuildState:
+    guild_id: int
+    game: Game
+    channel_to_zone: dict[int, Zone] = field(default_factory=dict)
+    zone_to_channel: dict[str, int] = field(default_factory=dict)
+    # Members whose first adventure is being started
+    onboarding: set[int] = field(default_factory=set)
+    bootstrap_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class GuildGames:
+    # Every guild gets its own game and database, so nothing about one guild
+    # is ever read or locked while updating another
+    def __init__(self, make_game: Callable[[str], Game], db_dir: str = "."):
+        self._make_game = make_game
+        self._db_dir = db_dir
+        self._guilds: dict[int, GuildState] = {}
+        self._rotation = 0
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+    def __iter__(self) -> Iterator[GuildState]:
+        return iter(list(self._guilds.values()))
+
+    def peek(self, guild_id: int) -> GuildState | None:
+        return self._guilds.get(guild_id)
+
+    def get(self, guild_id: int) -> GuildState:
+        state = self._guilds.get(guild_id)
+        if state is None:
+            game = self._make_game(guild_db_path(self._db_dir, guild_id))
+            state = GuildState(guild_id, game)
+            self._guilds[guild_id] = state
+        return state
+
+    def games(self) -> list[Game]:
+        return [state.game for state in self._guilds.values()]
+
+    def due_slices(
+        self, current_time: float, slice_size: int = GUILD_SLICE_SIZE
+    ) -> Iterator[tuple[GuildState, list[int]]]:
+        # Each round takes up to a slice of due players from every guild, so a
+        # large guild can't hold up the rest. Due players are looked up again
+        # every round, but only up to the cycle's start, so the cycle ends and
+        # players who come due during it wait for the next one. The first
+        # guild moves along every cycle so none of them is always served first
+        guilds = list(self._guilds.values())
+        if len(guilds) == 0:
+            return
+        start = self._rotation % len(guilds)
+        self._rotation += 1
+        guilds = guilds[start:] + guilds[:start]
+        while True:
+            served = False
+            for state in guilds:
+                # Guilds dropped part way through the cycle are skipped
+                if self._guilds.get(state.guild_id) is not state:
+                    continue
+                user_ids = state.game.scheduler.pop_due(current_time, slice_size)
+                if len(user_ids) == 0:
+                    continue
+                served = True
+                yield state, user_ids
+            if not served:
+                return
+
+    async def remove(self, guild_id: int):
+        # Writes back what it can and gives up the guild's lease, another
+        # process may already have taken it over
+        state = self._guilds.pop(guild_id, None)
+        if state is None:
+            return
+        async with state.game.cycle_lock:
+            await state.game.close()
+
+    async def close(self):
+        # One guild failing to close doesn't stop the rest writing back
+        failed: list[int] = []
+        for state in list(self._guilds.values()):
+            try:
+                await state.game.close()
+            except Exception:
+                print(f"Failed to close guild {state.guild_id}")
+                traceback.print_exc()
+                failed.append(state.guild_id)
+        if len(failed) > 0:
+            raise Exception(f"Failed to close guilds {failed}")
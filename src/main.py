@@ -1,41 +1,173 @@
+import asyncio
 import json
+import os
 import time
-from collections.abc import Mapping
+import traceback
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from functools import partial
 
 import discord
 from discord.app_commands import CommandTree
 from discord.ext import tasks
 
+import reports
+from bootstrap import BootstrapTasks
 from game.adventure import AdventureReport
-from game.game import Game
+from game.content import prune_cached
+from game.game import LEASE_DURATION, Game, content_changed, reload_content
 from game.items import ITEMS
+from game.quests import QUESTS
+from game.reload import CONTENT_VERSION
+from game.rendering import render_inventory
 from game.tags import TagType
+from game.workers import SimulationWorkers
 from game.zones import ZONES, Zone
-
-guild_id = 1229078590713364602
+from guilds import GuildGames, GuildState
+from metrics import COUNT_BUCKETS, METRICS
+from outbox import MessageOutbox
+from shards import lease_owner, load_shard_config
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-
-client = discord.Client(intents=intents)
+# Presences let offline members sleep until they come back. It's a privileged
+# intent, so it's only asked for when RPGBOT_PRESENCES is set, and has to be
+# enabled for the bot in the developer portal first
+track_presences = os.environ.get("RPGBOT_PRESENCES", "") not in ("", "0")
+intents.presences = track_presences
+
+# Processes can split the gateway shards between them, each one then only
+# runs the games of the guilds on its own shards
+shards = load_shard_config()
+if shards.sharded:
+    client = discord.AutoShardedClient(
+        intents=intents, shard_count=shards.shard_count, shard_ids=shards.shard_ids
+    )
+else:
+    client = discord.Client(intents=intents)
 tree = CommandTree(client)
 
-game = Game()
+# Adventures are simulated in this many worker processes when set, shared by
+# every guild, and simple quests are batched with numpy when enabled, which
+# gives up exact replays. Superseded adventures are compacted after the
+# retention period. Worker processes import this module again, so the
+# workers are only started by run_bot
+worker_count = int(os.environ.get("RPGBOT_WORKERS", "0"))
+workers: SimulationWorkers | None = None
+numpy_backend = os.environ.get("RPGBOT_NUMPY", "") not in ("", "0")
+history_retention = int(
+    float(os.environ.get("RPGBOT_HISTORY_RETENTION_DAYS", "7")) * 24 * 60 * 60
+)
+
+
+def make_game(db_path: str) -> Game:
+    return Game(
+        db_path,
+        numpy_backend=numpy_backend,
+        workers=workers if workers is not None else 0,
+        history_retention=history_retention,
+        # Every guild has its own database, so each needs fewer readers
+        readers=2,
+    )
+
+
+# Each guild's database is kept here. Every process using a database holds
+# its lease, so two processes never write the same guild's players
+guilds = GuildGames(make_game, os.environ.get("RPGBOT_DB_DIR", "."))
+owner = lease_owner(shards)
+
+STARTING_ZONE = "forest"
+
+outbox = MessageOutbox()
+
+# Metrics are written here every flush when set, a .json path dumps json
+# and anything else is written as prometheus text
+metrics_dump_path = os.environ.get("RPGBOT_METRICS_DUMP")
 
-channel_to_zone: Mapping[int, Zone] = {}
-zone_to_channel: Mapping[str, int] = {}
+# The data files are checked for changes this often when set, and reloaded
+content_poll_interval = float(os.environ.get("RPGBOT_CONTENT_POLL", "0"))
 
-message_edit_queue: list[tuple[str, discord.PartialMessage]] = []
+
+commands_synced = False
 
 
 @client.event
 async def on_ready():
-    print("Initializing Zones")
-    # Find existing zones
-    guild = client.get_guild(guild_id)
-    if guild is None or guild.self_role is None:
+    global commands_synced
+    # Also runs after reconnecting, every step only does what's still missing
+    await setup_guilds(client.guilds)
+
+    # Commands are global, so they only need syncing once
+    if not commands_synced:
+        try:
+            await tree.sync()
+            commands_synced = True
+        except Exception:
+            traceback.print_exc()
+
+    print(f"We have logged in as {client.user}")
+    if not update_adventures.is_running():
+        update_adventures.start()
+    if not flush_players.is_running():
+        flush_players.start()
+    if not compact_history.is_running():
+        compact_history.start()
+    if not renew_leases.is_running():
+        renew_leases.start()
+    if content_poll_interval > 0 and not watch_content.is_running():
+        watch_content.change_interval(seconds=content_poll_interval)
+        watch_content.start()
+
+
+@client.event
+async def on_guild_join(guild: discord.Guild):
+    await setup_guild(guild)
+
+
+async def setup_guilds(pending: Sequence[discord.Guild]):
+    # Guilds are set up side by side, a few at a time, setup_guild handles
+    # its own failures
+    await BootstrapTasks().run(
+        "setup_guilds",
+        "Setting up guilds",
+        [partial(setup_guild, guild) for guild in pending],
+    )
+
+
+async def setup_guild(guild: discord.Guild):
+    if not shards.owns(guild.id):
+        return
+    state = guilds.get(guild.id)
+    try:
+        await state.game.acquire_lease(owner)
+    except Exception as e:
+        # Most likely the process that had these shards before is yet to let
+        # go of it, setup is tried again when leases are renewed
+        print(f"Skipping {guild.name} for now: {e}")
+        await guilds.remove(guild.id)
+        return
+    try:
+        async with state.bootstrap_lock:
+            await bootstrap(guild, state)
+    except Exception:
+        # One guild failing shouldn't hold up the others, it's set up again
+        # when leases are renewed
+        print(f"Failed to set up {guild.name}")
+        traceback.print_exc()
+        try:
+            await guilds.remove(guild.id)
+        except Exception:
+            traceback.print_exc()
+
+
+async def bootstrap(guild: discord.Guild, state: GuildState):
+    print(f"Initializing Zones for {guild.name}")
+    if guild.self_role is None:
         raise Exception("Invalid Guild")
+    game = state.game
+    channel_to_zone = state.channel_to_zone
+    zone_to_channel = state.zone_to_channel
+    # Find existing zones
     found_zones: set[str] = set()
     for channel in guild.channels:
         zone = ZONES.get(channel.name, None)
@@ -44,62 +176,108 @@ async def on_ready():
             zone_to_channel[zone.zone_id] = channel.id
             found_zones.add(zone.zone_id)
 
-    # Clear out all channels
-    if game.is_fresh:
+    # Clear out all channels, the reset is only marked done once they're all
+    # gone so an interrupted start carries on with the rest
+    if await game.get_bot_state("zone_channels") == "reset":
+        jobs: list[Callable[[], Awaitable[None]]] = []
         for zone_id in found_zones:
-            channel_id = zone_to_channel[zone_id]
+            channel_id = zone_to_channel.pop(zone_id)
+            del channel_to_zone[channel_id]
             channel = guild.get_channel(channel_id)
             if channel is None or not isinstance(channel, discord.TextChannel):
                 continue
-            await channel.delete()
+            jobs.append(channel.delete)
         found_zones.clear()
+        if not await BootstrapTasks().run(
+            "delete_channels", "Deleting zone channels", jobs
+        ):
+            raise Exception("Failed to clear out zone channels")
+        await game.set_bot_state("zone_channels", None)
 
     # Add new zones to the server
+    await add_zone_channels(guild, state, found_zones)
+
+    # Queue up an update for everyone who is online, members who haven't
+    # adventured yet are started when they first use the bot. Without
+    # presences everyone looks offline, so everyone is woken
+    current_time = time.time()
+    for user in guild.members:
+        if track_presences and user.status == discord.Status.offline:
+            game.scheduler.sleep(user.id)
+            continue
+        game.scheduler.wake(user.id, current_time)
+
+
+async def add_zone_channels(
+    guild: discord.Guild, state: GuildState, found_zones: set[str]
+):
+    if guild.self_role is None:
+        raise Exception("Invalid Guild")
+    self_role = guild.self_role
     self_overwrite = discord.PermissionOverwrite()
     self_overwrite.view_channel = True
     self_overwrite.manage_channels = True
-    for zone_id, zone in ZONES.items():
-        if zone_id in found_zones:
-            continue
+
+    async def create_channel(zone: Zone):
         hidden_overwrite = discord.PermissionOverwrite()
         hidden_overwrite.view_channel = zone.public
         channel = await guild.create_text_channel(
-            zone_id,
+            zone.zone_id,
             overwrites={
                 guild.roles[0]: hidden_overwrite,
-                guild.self_role: self_overwrite,
+                self_role: self_overwrite,
             },
         )
-        channel_to_zone[channel.id] = zone
-        zone_to_channel[zone.zone_id] = channel.id
+        state.channel_to_zone[channel.id] = zone
+        state.zone_to_channel[zone.zone_id] = channel.id
+
+    # Channels that fail to be made are tried again on the next start
+    await BootstrapTasks().run(
+        "create_channels",
+        "Creating zone channels",
+        [
+            partial(create_channel, zone)
+            for zone_id, zone in ZONES.items()
+            if zone_id not in found_zones
+        ],
+    )
 
-    # Start a new adventure for all current members
-    if game.is_fresh:
-        for user in client.get_all_members():
-            await start_adventure(user, zone_to_channel["forest"])
 
-    print(f"We have logged in as {client.user}")
-    await tree.sync(guild=discord.Object(id=guild_id))
-    update_adventures.start()
+async def onboard(state: GuildState, user: discord.Member):
+    # Members start adventuring the first time they use the bot, rather than
+    # everyone at once when it starts
+    if user.id in state.onboarding:
+        return
+    state.onboarding.add(user.id)
+    try:
+        if await state.game.has_adventure(user.id):
+            return
+        await start_adventure(state, user, state.zone_to_channel[STARTING_ZONE])
+    finally:
+        state.onboarding.discard(user.id)
 
 
 def get_interaction_info(
     interaction: discord.Interaction,
-) -> tuple[discord.Guild, discord.TextChannel, discord.Member]:
+) -> tuple[discord.Guild, GuildState, discord.TextChannel, discord.Member]:
     guild = interaction.guild
     if guild is None:
         raise Exception("Invalid guild")
+    state = guilds.peek(guild.id)
+    if state is None:
+        raise Exception("Guild has not been set up")
     channel = interaction.channel
     if channel is None or not isinstance(channel, discord.TextChannel):
         raise Exception("Invalid channel")
     user = interaction.user
     if not isinstance(user, discord.Member):
         raise Exception("User is not a member")
-    return guild, channel, user
+    return guild, state, channel, user
 
 
 async def handle_adventure_report(
     guild: discord.Guild,
+    state: GuildState,
     channel: discord.TextChannel,
     user: discord.Member,
     report: AdventureReport,
@@ -110,49 +288,25 @@ async def handle_adventure_report(
     for adventure_group in report.adventure_groups:
         for adventure_step in adventure_group.steps:
             for zone_id in adventure_step.get_discovered_zones():
-                discovered_channel_id = zone_to_channel[zone_id]
+                discovered_channel_id = state.zone_to_channel[zone_id]
                 discovered_channel = guild.get_channel(discovered_channel_id)
                 if not isinstance(discovered_channel, discord.TextChannel):
                     continue
                 await channel.set_permissions(user, overwrite=shown_overwrite)
 
     # Send updates to the adventure thread
-    await send_adventure_report(channel, report)
+    await send_adventure_report(state, channel, report)
 
 
-async def send_adventure_report(channel: discord.TextChannel, report: AdventureReport):
+async def send_adventure_report(
+    state: GuildState, channel: discord.TextChannel, report: AdventureReport
+):
     # Send report
     thread_id = report.adventure.thread_id
     thread = channel.get_thread(thread_id)
     if not thread:
         raise Exception(f"Thread not found: {thread_id}")
-    adventure_id = report.adventure.adventure_id
-    merge_group_ids = {
-        group.group_id for group in report.adventure_groups if group.merge
-    }
-    for group_id in merge_group_ids:
-        group = game.storage_model.get_adventure_results(adventure_id, group_id)
-        count, message_id = game.storage_model.get_group_info(adventure_id, group_id)
-        display_lines: list[str] = []
-        display_lines.append(f"x{count}:")
-        for step in group.steps:
-            display_lines.append(step.display())
-        full_message = "\n".join(display_lines)
-        if message_id is None:
-            message = await thread.send(full_message)
-            with game.storage_model as t:
-                t.add_group_message(adventure_id, group_id, message.id)
-            continue
-        message = thread.get_partial_message(message_id)
-        message_edit_queue.append((full_message, message))
-
-    for normal_group in [group for group in report.adventure_groups if not group.merge]:
-        print(f"New quest for {thread.name}: {normal_group.group_id}")
-        display_lines: list[str] = []
-        for step in normal_group.steps:
-            display_lines.append(step.display())
-        full_message = "\n".join(display_lines)
-        await thread.send(full_message)
+    await reports.send_adventure_report(state.game, outbox, thread, report)
 
 
 last_report = 0
@@ -166,37 +320,144 @@ async def update_adventures():
         return
     last_report = current_time
 
-    if len(message_edit_queue) > 0:
-        print(f"Message queue length: {len(message_edit_queue)}")
-    if len(message_edit_queue) == 0:
-        print("Updating adventures")
-        for user in client.get_all_members():
-            # Update the user's active adventure
-            report = game.update_adventure(user.id)
-            if report is not None:
-                guild = client.get_guild(guild_id)
-                if guild is None:
-                    print(f"Guild {guild_id} was not found")
-                    continue
-                zone_id = report.adventure.zone_id
-                channel_id = zone_to_channel[zone_id]
-                channel = guild.get_channel(channel_id)
-                if channel is None or not isinstance(channel, discord.TextChannel):
-                    print(f"Channel {channel_id} was invalid")
-                    continue
-                await handle_adventure_report(guild, channel, user, report)
-        # print("End new messages")
+    if len(outbox) > 0:
+        print(f"Message queue length: {len(outbox)}")
+    print("Updating adventures")
+    with METRICS.timer("cycle.duration"):
+        await update_due_adventures(current_time)
+
+
+async def update_due_adventures(current_time: float):
+    # Guilds take turns a slice of players at a time
+    due_count = 0
+    for state, due_users in guilds.due_slices(current_time):
+        due_count += len(due_users)
+        guild = client.get_guild(state.guild_id)
+        if guild is None:
+            for user_id in due_users:
+                state.game.scheduler.sleep(user_id)
+            continue
+        user_ids: list[int] = []
+        for user_id in due_users:
+            if guild.get_member(user_id) is None:
+                state.game.scheduler.sleep(user_id)
+                continue
+            user_ids.append(user_id)
+        # Update the users' active adventures
+        await handle_adventure_reports(
+            guild, state, state.game.update_adventures(user_ids)
+        )
+    METRICS.observe("cycle.due_users", due_count, COUNT_BUCKETS)
+    METRICS.gauge(
+        "scheduler.scheduled", sum(len(state.game.scheduler) for state in guilds)
+    )
 
-    for _ in range(min(len(message_edit_queue), 1)):
-        # print("Editing message")
-        content, message = message_edit_queue.pop()
-        await message.edit(content=content)
 
+async def handle_adventure_reports(
+    guild: discord.Guild,
+    state: GuildState,
+    reports: AsyncIterator[AdventureReport],
+):
+    # Each chunk of a long catch up is sent on as soon as it is simulated
+    async for report in reports:
+        user = guild.get_member(report.adventure.user_id)
+        if user is None:
+            continue
+        zone_id = report.adventure.zone_id
+        channel_id = state.zone_to_channel[zone_id]
+        channel = guild.get_channel(channel_id)
+        if channel is None or not isinstance(channel, discord.TextChannel):
+            print(f"Channel {channel_id} was invalid")
+            continue
+        await handle_adventure_report(guild, state, channel, user, report)
+
+
+@tasks.loop(seconds=10)
+async def flush_players():
+    for state in guilds:
+        await state.game.flush()
+    if metrics_dump_path is not None and METRICS.enabled:
+        METRICS.dump(metrics_dump_path)
+
+
+@tasks.loop(minutes=5)
+async def compact_history():
+    for state in guilds:
+        compacted = await state.game.compact_history()
+        if compacted > 0:
+            print(f"Compacted {compacted} old adventures in {state.guild_id}")
+
+
+@tasks.loop(seconds=LEASE_DURATION / 3)
+async def renew_leases():
+    # Guilds whose lease was taken over are dropped, and guilds that couldn't
+    # be set up are tried again
+    for state in guilds:
+        try:
+            await state.game.acquire_lease(owner)
+        except Exception as e:
+            print(f"Lost guild {state.guild_id}: {e}")
+            try:
+                await guilds.remove(state.guild_id)
+            except Exception as close_error:
+                print(f"Guild {state.guild_id} was not written back: {close_error}")
+    await setup_guilds(
+        [guild for guild in client.guilds if guilds.peek(guild.id) is None]
+    )
 
-async def start_adventure(user: discord.Member, channel_id: int):
-    guild = client.get_guild(guild_id)
-    if guild is None:
+
+@tasks.loop(seconds=10)
+async def watch_content():
+    if not await content_changed():
+        return
+    print("Content changed, reloading")
+    await reload_all_content()
+
+
+async def reload_all_content() -> list[str]:
+    errors = await reload_content(guilds.games())
+    if len(errors) > 0:
+        print("Content reload failed:\n" + "\n".join(errors))
+        return errors
+
+    # Point channels at the new zones and add channels for any new ones
+    for state in guilds:
+        for channel_id, zone in list(state.channel_to_zone.items()):
+            new_zone = ZONES.get(zone.zone_id)
+            if new_zone is None:
+                # Removed zones keep their channel, the bot just stops using it
+                del state.channel_to_zone[channel_id]
+                state.zone_to_channel.pop(zone.zone_id, None)
+                continue
+            state.channel_to_zone[channel_id] = new_zone
+        guild = client.get_guild(state.guild_id)
+        if guild is not None:
+            await add_zone_channels(guild, state, set(state.zone_to_channel))
+    print("Content reloaded")
+    return errors
+
+
+@client.event
+async def on_presence_update(before: discord.Member, after: discord.Member):
+    state = guilds.peek(after.guild.id)
+    if state is None:
         return
+    # Offline members are put to sleep and caught up when they come back
+    if after.status == discord.Status.offline:
+        state.game.scheduler.sleep(after.id)
+    elif before.status == discord.Status.offline:
+        state.game.scheduler.wake(after.id, time.time())
+
+
+@client.event
+async def on_member_remove(member: discord.Member):
+    state = guilds.peek(member.guild.id)
+    if state is not None:
+        state.game.scheduler.sleep(member.id)
+
+
+async def start_adventure(state: GuildState, user: discord.Member, channel_id: int):
+    guild = user.guild
     channel = client.get_channel(channel_id)
     if channel_id is None or not isinstance(channel, discord.TextChannel):
         return
@@ -204,72 +465,138 @@ async def start_adventure(user: discord.Member, channel_id: int):
     thread = await channel.create_thread(
         name=f"{name}'s adventure report", type=discord.ChannelType.public_thread
     )
-    zone = channel_to_zone[channel.id]
-    report = game.start_adventure(user.id, zone.zone_id, thread.id)
-    if report is not None:
-        await handle_adventure_report(guild, channel, user, report)
+    zone = state.channel_to_zone[channel.id]
+    await handle_adventure_reports(
+        guild, state, state.game.start_adventure(user.id, zone.zone_id, thread.id)
+    )
 
 
 @tree.command(
     name="adventure",
     description="Start adventuring in this area.",
-    guild=discord.Object(id=guild_id),
 )
 async def adventure(interaction: discord.Interaction):
-    guild, channel, user = get_interaction_info(interaction)
+    guild, state, channel, user = get_interaction_info(interaction)
     name = user.display_name
     thread = await channel.create_thread(
         name=f"{name}'s adventure report", type=discord.ChannelType.public_thread
     )
-    zone = channel_to_zone[channel.id]
-
-    report = game.start_adventure(user.id, zone.zone_id, thread.id)
-    await interaction.response.send_message(f"{name} is adventuring in this area.")
+    zone = state.channel_to_zone[channel.id]
 
-    if report is not None:
-        await handle_adventure_report(guild, channel, user, report)
+    # Catching up on the previous adventure can take a while
+    await interaction.response.defer()
+    await handle_adventure_reports(
+        guild, state, state.game.start_adventure(user.id, zone.zone_id, thread.id)
+    )
+    await interaction.followup.send(f"{name} is adventuring in this area.")
 
 
 @tree.command(
     name="inventory",
     description="View the items in your inventory",
-    guild=discord.Object(id=guild_id),
 )
 async def inventory(interaction: discord.Interaction):
-    guild, channel, user = get_interaction_info(interaction)
+    guild, state, channel, user = get_interaction_info(interaction)
+    game = state.game
 
-    report = game.update_adventure(user.id)
+    # Catching up on the adventure can take a while
+    await interaction.response.defer(ephemeral=True)
+    await onboard(state, user)
+    game.scheduler.wake(user.id, time.time())
+    await handle_adventure_reports(guild, state, game.update_adventure(user.id))
+
+    player_tags = await game.get_player_tags(user.id)
+    await interaction.followup.send(render_inventory(player_tags), ephemeral=True)
 
-    items = game.get_player_tags(user.id).get_inventory(TagType.ITEM).get_all_tags()
-    item_list = "\n".join(
-        [f"    {quantity}x {ITEMS[item].name}" for item, quantity in items]
-    )
-    response_string = f"Inventory: \n{item_list}"
-    await interaction.response.send_message(response_string, ephemeral=True)
 
-    if report is not None:
-        await handle_adventure_report(guild, channel, user, report)
+@tree.command(
+    name="stats",
+    description="View performance stats for the bot",
+)
+async def stats(interaction: discord.Interaction):
+    _, _, _, user = get_interaction_info(interaction)
+    if not user.guild_permissions.administrator:
+        await interaction.response.send_message(
+            "Only administrators can view stats", ephemeral=True
+        )
+        return
+    if not METRICS.enabled:
+        await interaction.response.send_message(
+            "Metrics are disabled, set RPGBOT_METRICS=1 to enable them",
+            ephemeral=True,
+        )
+        return
+    METRICS.gauge("outbox.pending", len(outbox))
+    summary = METRICS.summary()
+    # Discord messages are limited to 2000 characters
+    await interaction.response.send_message(
+        f"```\n{summary[:1980]}\n```", ephemeral=True
+    )
 
 
 @tree.command(
-    name="give", description="Give yourself an item", guild=discord.Object(id=guild_id)
+    name="reload",
+    description="Reload quests, items and zones from the data files",
 )
+async def reload(interaction: discord.Interaction):
+    _, _, _, user = get_interaction_info(interaction)
+    if not user.guild_permissions.administrator:
+        await interaction.response.send_message(
+            "Only administrators can reload content", ephemeral=True
+        )
+        return
+    await interaction.response.defer(ephemeral=True)
+    # Only this process reloads, other shards pick changes up by polling
+    errors = await reload_all_content()
+    if len(errors) > 0:
+        message = "Content was not reloaded:\n" + "\n".join(errors)
+        await interaction.followup.send(message[:2000], ephemeral=True)
+        return
+    await interaction.followup.send(
+        f"Reloaded {len(QUESTS)} quests, {len(ITEMS)} items and {len(ZONES)} zones",
+        ephemeral=True,
+    )
+
+
+@tree.command(name="give", description="Give yourself an item")
 async def give(interaction: discord.Interaction, item_id: str, quantity: int):
-    user = interaction.user
+    _, state, _, user = get_interaction_info(interaction)
 
-    with game.storage_model as t:
-        t.add_remove_tag(user.id, TagType.ITEM, item_id, quantity)
+    if not await state.game.add_remove_tag(user.id, TagType.ITEM, item_id, quantity):
+        await interaction.response.send_message(
+            f"{user.display_name} doesn't have {-quantity} {ITEMS[item_id].name}",
+            ephemeral=True,
+        )
+        return
+    state.game.scheduler.wake(user.id, time.time())
     await interaction.response.send_message(
         f"{user.display_name} is cheating! "
         + f"They gave themself {quantity} {ITEMS[item_id].name}"
     )
 
 
-connection_strings = None
-with open("connection_strings.json", mode="r") as f:
-    connection_strings = json.load(f)
+async def run_bot(token: str):
+    global workers
+    prune_cached(CONTENT_VERSION.loaded)
+    if worker_count > 0:
+        workers = SimulationWorkers(worker_count)
+    try:
+        async with client:
+            await client.start(token)
+    finally:
+        # Write back anything still held in the player caches
+        await guilds.close()
+        if workers is not None:
+            workers.close()
+
+
+if __name__ == "__main__":
+    connection_strings = None
+    with open("connection_strings.json", mode="r") as f:
+        connection_strings = json.load(f)
 
-if not connection_strings:
-    print("Failed to parse connection strings file")
+    if not connection_strings:
+        print("Failed to parse connection strings file")
 
-client.run(connection_strings["token"])
+    discord.utils.setup_logging()
+    asyncio.run(run_bot(connection_strings["token"]))
@@ -0,0 +1,202 @@
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any
+
+# Upper bounds in seconds, anything slower lands in the implicit +Inf bucket
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+)
+COUNT_BUCKETS = (1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    counts: list[int] = field(default_factory=list)
+    count: int = 0
+    total: float = 0
+
+    def __post_init__(self):
+        if len(self.counts) == 0:
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, fraction: float) -> float:
+        # Approximated by the upper bound of the bucket the quantile falls in
+        target = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target and bucket_count > 0:
+                if index < len(self.buckets):
+                    return self.buckets[index]
+                return float("inf")
+        return 0
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = {}
+        self._gauges: dict[str, float] = {}
+        self._histograms: dict[str, Histogram] = {}
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        if not self.enabled:
+            return
+        self._gauges[name] = value
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = ()):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = Histogram(buckets) if buckets else Histogram()
+                self._histograms[name] = histogram
+            histogram.observe(value)
+
+    @contextmanager
+    def _timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timer(self, name: str):
+        if not self.enabled:
+            return _DISABLED_TIMER
+        return self._timer(name)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": {
+                    name: {
+                        "count": histogram.count,
+                        "sum": histogram.total,
+                        "p50": histogram.quantile(0.5),
+                        "p99": histogram.quantile(0.99),
+                        "unit": (
+                            "seconds"
+                            if histogram.buckets == DEFAULT_BUCKETS
+                            else "count"
+                        ),
+                        "buckets": dict(
+                            zip(
+                                [*map(str, histogram.buckets), "+Inf"],
+                                histogram.counts,
+                            )
+                        ),
+                    }
+                    for name, histogram in self._histograms.items()
+                },
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        lines: list[str] = []
+        snapshot = self.snapshot()
+        for name, value in snapshot["counters"].items():
+            metric = prometheus_name(name)
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, value in snapshot["gauges"].items():
+            metric = prometheus_name(name)
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        for name, histogram in snapshot["histograms"].items():
+            metric = prometheus_name(name)
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bucket, bucket_count in histogram["buckets"].items():
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{le="{bucket}"}} {cumulative}')
+            lines.append(f"{metric}_sum {histogram['sum']}")
+            lines.append(f"{metric}_count {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        # The format is picked from the file extension, .json or prometheus text
+        content = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, mode="w") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        lines: list[str] = []
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            average = histogram["sum"] / max(histogram["count"], 1)
+            if histogram["unit"] == "seconds":
+                lines.append(
+                    f"{name}: {histogram['count']}x avg {average * 1000:.2f}ms "
+                    + f"p99 <{histogram['p99'] * 1000:.1f}ms"
+                )
+            else:
+                lines.append(
+                    f"{name}: {histogram['count']}x avg {average:.1f} "
+                    + f"p99 <{histogram['p99']:g}"
+                )
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{name}: {value}")
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f"{name}: {value:g}")
+        return "\n".join(lines)
+
+
+def prometheus_name(name: str) -> str:
+    # Anything prometheus doesn't allow in a metric name becomes _
+    return "rpgbot_" + re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+class _DisabledTimer:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):  # type: ignore
+        return False
+
+
+_DISABLED_TIMER = _DisabledTimer()
+
+METRICS = Metrics(enabled=os.environ.get("RPGBOT_METRICS", "") not in ("", "0"))
@@ -0,0 +1,130 @@
+import asyncio
+import time
+import traceback
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import dataclass
+
+from metrics import METRICS
+
+# Discord allows roughly 5 messages per 5 seconds in a channel and
+# 50 requests per second for the whole bot
+ROUTE_RATE = 1.0
+ROUTE_BURST = 5
+GLOBAL_RATE = 45.0
+GLOBAL_BURST = 50
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        # Takes a token if one is available, otherwise returns how long
+        # to wait until there will be one
+        current_time = time.monotonic()
+        self._tokens = min(
+            self._capacity,
+            self._tokens + (current_time - self._updated) * self._rate,
+        )
+        self._updated = current_time
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    async def acquire(self):
+        while True:
+            delay = self.take()
+            if delay == 0:
+                return
+            await asyncio.sleep(delay)
+
+
+@dataclass
+class OutboxEntry:
+    content: str
+    deliver: Callable[[str], Awaitable[None]]
+
+
+class Route:
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.pending: OrderedDict[Hashable, OutboxEntry] = OrderedDict()
+        self.worker: asyncio.Task[None] | None = None
+
+
+class MessageOutbox:
+    def __init__(
+        self,
+        route_rate: float = ROUTE_RATE,
+        route_burst: float = ROUTE_BURST,
+        global_rate: float = GLOBAL_RATE,
+        global_burst: float = GLOBAL_BURST,
+    ):
+        self._route_rate = route_rate
+        self._route_burst = route_burst
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._routes: dict[int, Route] = {}
+
+    def __len__(self) -> int:
+        return sum(len(route.pending) for route in self._routes.values())
+
+    def queue(
+        self,
+        route_id: int,
+        key: Hashable,
+        content: str,
+        deliver: Callable[[str], Awaitable[None]],
+    ):
+        # Entries with the same key are coalesced, only the latest content is
+        # delivered but the entry keeps its place in the route's queue
+        route = self._routes.get(route_id)
+        if route is None:
+            route = Route(self._route_rate, self._route_burst)
+            self._routes[route_id] = route
+        entry = route.pending.get(key)
+        if entry is not None:
+            entry.content = content
+            entry.deliver = deliver
+        else:
+            route.pending[key] = OutboxEntry(content, deliver)
+        if route.worker is None:
+            route.worker = asyncio.create_task(self._run_route(route_id, route))
+        if METRICS.enabled:
+            METRICS.gauge("outbox.pending", len(self))
+
+    async def _run_route(self, route_id: int, route: Route):
+        # Entries on a route are delivered one at a time and in order, so a
+        # message is always sent before anything queued after it is edited
+        try:
+            while len(route.pending) > 0:
+                await route.bucket.acquire()
+                await self._global_bucket.acquire()
+                _, entry = route.pending.popitem(last=False)
+                try:
+                    with METRICS.timer("discord.deliver"):
+                        await entry.deliver(entry.content)
+                    METRICS.count("discord.delivered")
+                except Exception:
+                    METRICS.count("discord.failed")
+                    print(f"Failed to deliver message to {route_id}")
+                    traceback.print_exc()
+        finally:
+            route.worker = None
+            if len(route.pending) == 0:
+                del self._routes[route_id]
+
+    async def drain(self):
+        while len(self._routes) > 0:
+            workers = [
+                route.worker
+                for route in self._routes.values()
+                if route.worker is not None
+            ]
+            if len(workers) == 0:
+                return
+            await asyncio.gather(*workers)
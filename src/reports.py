@@ -0,0 +1,76 @@
+from typing import Any, Protocol
+
+from game.adventure import AdventureGroup, AdventureReport, ReportDigest
+from game.game import Game
+from game.groupcache import MergedGroup
+from game.rendering import render_steps
+from metrics import METRICS
+from outbox import MessageOutbox
+
+
+class ReportMessage(Protocol):
+    async def edit(self, *, content: str) -> Any: ...
+
+
+class ReportThread(Protocol):
+    id: int
+    name: str
+
+    async def send(self, content: str) -> Any: ...
+
+    def get_partial_message(self, message_id: int) -> ReportMessage: ...
+
+
+async def send_adventure_report(
+    game: Game, outbox: MessageOutbox, thread: ReportThread, report: AdventureReport
+):
+    with METRICS.timer("report.send"):
+        await queue_adventure_report(game, outbox, thread, report)
+
+
+async def queue_adventure_report(
+    game: Game, outbox: MessageOutbox, thread: ReportThread, report: AdventureReport
+):
+    user_id = report.adventure.user_id
+    adventure_id = report.adventure.adventure_id
+    merge_groups: dict[str, list[AdventureGroup]] = {}
+    for group in report.adventure_groups:
+        if group.merge:
+            merge_groups.setdefault(group.group_id, []).append(group)
+    for group_id, groups in merge_groups.items():
+        merged = await game.get_merged_group(user_id, adventure_id, group_id)
+        merged.add_groups(groups, report.end_time)
+
+        async def deliver_group(
+            content: str, group_id: str = group_id, merged: MergedGroup = merged
+        ):
+            # Looked up on delivery, the group's first message may have been
+            # sent since this update was queued
+            if merged.message_id is None:
+                message = await thread.send(content)
+                merged.message_id = message.id
+                await game.add_group_message(adventure_id, group_id, message.id)
+                return
+            await thread.get_partial_message(merged.message_id).edit(content=content)
+
+        outbox.queue(
+            thread.id, (adventure_id, group_id), merged.display(), deliver_group
+        )
+
+    async def deliver_quest(content: str):
+        await thread.send(content)
+
+    # Chunks of one update share a digest, it's sent with the last of them
+    digest = report.digest if report.digest is not None else ReportDigest()
+    for normal_group in digest.add(report):
+        print(f"New quest for {thread.name}: {normal_group.group_id}")
+        full_message = render_steps(
+            (step.quest, step.tags_changed) for step in normal_group.steps
+        )
+        # Every quest gets its own message, so use a key that never coalesces
+        outbox.queue(thread.id, object(), full_message, deliver_quest)
+    if not report.caught_up:
+        return
+    digest_message = digest.finish()
+    if digest_message is not None:
+        outbox.queue(thread.id, object(), digest_message, deliver_quest)
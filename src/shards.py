@@ -0,0 +1,49 @@
+import os
+import socket
+from dataclasses import dataclass, field
+
+
+def shard_for_guild(guild_id: int, shard_count: int) -> int:
+    # The gateway sends each guild's events to this shard
+    return (guild_id >> 22) % shard_count
+
+
+@dataclass
+class ShardConfig:
+    # The shards this process connects, out of shard_count across every
+    # process. Guilds live on one shard, so each process only ever loads and
+    # writes the players of its own guilds
+    shard_count: int = 1
+    shard_ids: list[int] = field(default_factory=lambda: [0])
+
+    def __post_init__(self):
+        if self.shard_count < 1:
+            raise Exception(f"Invalid shard count: {self.shard_count}")
+        for shard_id in self.shard_ids:
+            if shard_id < 0 or shard_id >= self.shard_count:
+                raise Exception(f"Shard {shard_id} is not below {self.shard_count}")
+
+    @property
+    def sharded(self) -> bool:
+        return self.shard_count > 1
+
+    def owns(self, guild_id: int) -> bool:
+        return shard_for_guild(guild_id, self.shard_count) in self.shard_ids
+
+
+def load_shard_config() -> ShardConfig:
+    # RPGBOT_SHARD_IDS is a comma separated list, all shards when unset
+    shard_count = int(os.environ.get("RPGBOT_SHARD_COUNT", "1"))
+    shard_ids = os.environ.get("RPGBOT_SHARD_IDS", "")
+    if shard_ids == "":
+        return ShardConfig(shard_count, list(range(shard_count)))
+    return ShardConfig(
+        shard_count, [int(shard_id) for shard_id in shard_ids.split(",")]
+    )
+
+
+def lease_owner(shards: ShardConfig) -> str:
+    # Unique to this process, so a second process started with the same
+    # shards can't write alongside it
+    shard_ids = ",".join(str(shard_id) for shard_id in shards.shard_ids)
+    return f"{socket.gethostname()}:{os.getpid()} shards {shard_ids}"
@@ -0,0 +1,139 @@
+import asyncio
+import queue
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from metrics import COUNT_BUCKETS, METRICS
+
+from .storagemodel import StorageModel, StorageTransaction
+
+T = TypeVar("T")
+
+# The write, its result and whether it's committed without waiting for more
+WriteJob = tuple[Callable[[StorageTransaction], Any], Future[Any], bool]
+
+
+class AsyncStorageModel:
+    def __init__(
+        self,
+        path: str = "game_data.db",
+        readers: int = 4,
+        flush_interval: float = 0.05,
+        statement_hook: Callable[[str], None] | None = None,
+    ):
+        self._path = path
+        self._statement_hook = statement_hook
+        self._flush_interval = flush_interval
+        self._writes: queue.SimpleQueue[WriteJob | None] = queue.SimpleQueue()
+        # Once set, every write checks this is still who holds the lease
+        self.lease_owner: str | None = None
+
+        # The writer owns the only read/write connection, it also runs any
+        # migrations so wait for it before opening the read only connections
+        writer_ready: Future[None] = Future()
+        self._writer = threading.Thread(
+            target=self._run_writer,
+            args=(writer_ready,),
+            name="storage-writer",
+            daemon=True,
+        )
+        self._writer.start()
+        writer_ready.result()
+
+        self._reader_state = threading.local()
+        self._readers = ThreadPoolExecutor(
+            max_workers=readers,
+            thread_name_prefix="storage-reader",
+            initializer=self._open_reader,
+        )
+
+    async def read(self, read_fn: Callable[[StorageModel], T]) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, read_fn)
+
+    async def write(
+        self, write_fn: Callable[[StorageTransaction], T], urgent: bool = False
+    ) -> T:
+        # Resolves once the batch containing this write has been committed.
+        # Urgent writes are for callers that hold up a player until they're
+        # done, their batch is committed as soon as the queue is empty
+        future: Future[T] = Future()
+        self._writes.put((write_fn, future, urgent))
+        return await asyncio.wrap_future(future)
+
+    def close(self):
+        self._writes.put(None)
+        self._writer.join()
+        self._readers.shutdown()
+
+    def _open_reader(self):
+        self._reader_state.storage_model = StorageModel(
+            self._path, read_only=True, statement_hook=self._statement_hook
+        )
+
+    def _run_read(self, read_fn: Callable[[StorageModel], T]) -> T:
+        with METRICS.timer("storage.read"):
+            return read_fn(self._reader_state.storage_model)
+
+    def _run_writer(self, writer_ready: Future[None]):
+        try:
+            storage_model = StorageModel(
+                self._path, statement_hook=self._statement_hook
+            )
+            storage_model.enable_wal()
+        except Exception as e:
+            writer_ready.set_exception(e)
+            return
+        writer_ready.set_result(None)
+
+        closing = False
+        while not closing:
+            job = self._writes.get()
+            if job is None:
+                break
+
+            # Gather everything that arrives within the flush interval into
+            # a single commit
+            batch = [job]
+            urgent = job[2]
+            flush_time = time.monotonic() + self._flush_interval
+            while True:
+                remaining = 0 if urgent else flush_time - time.monotonic()
+                try:
+                    job = self._writes.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    break
+                if job is None:
+                    closing = True
+                    break
+                batch.append(job)
+                urgent = urgent or job[2]
+
+            METRICS.observe("storage.write_batch", len(batch), COUNT_BUCKETS)
+            METRICS.gauge("storage.write_queue", self._writes.qsize())
+            results: list[tuple[Future[Any], Any, BaseException | None]] = []
+            try:
+                with METRICS.timer("storage.write"), storage_model as t:
+                    if self.lease_owner is not None:
+                        t.check_lease(self.lease_owner)
+                    for write_fn, future, _ in batch:
+                        try:
+                            with t.savepoint():
+                                result = write_fn(t)
+                        except Exception as e:
+                            results.append((future, None, e))
+                            continue
+                        results.append((future, result, None))
+            except Exception as e:
+                results = [(future, None, e) for _, future, _ in batch]
+
+            for future, result, exception in results:
+                if exception is not None:
+                    future.set_exception(exception)
+                else:
+                    future.set_result(result)
+
+        storage_model.close()
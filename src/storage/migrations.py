@@ -0,0 +1,199 @@
+from collections.abc import Callable
+from sqlite3 import Connection, Cursor
+
+
+def create_tables(cursor: Cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS player_adventure(
+            adventure_id INTEGER PRIMARY KEY ASC,
+            user_id INT,
+            zone_id STR,
+            last_updated INT,
+            thread_id INT
+        )
+        """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS player_tags(
+            user_id INT,
+            type STR,
+            tag STR,
+            quantity INT
+        )
+        """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quest_group_info(
+            adventure_id INT,
+            group_id STR,
+            count INT,
+            message_id INT
+        )
+        """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS adventure_results(
+            adventure_id INT,
+            group_id STR,
+            quest_id STR,
+            type STR,
+            tag STR,
+            quantity INT
+        )
+        """)
+
+
+def add_primary_keys(cursor: Cursor):
+    # Rows are copied into keyed tables, merging any duplicates that the
+    # old unkeyed tables allowed
+    cursor.execute("""
+        CREATE TABLE player_tags_keyed(
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY(user_id, type, tag)
+        ) WITHOUT ROWID
+        """)
+    cursor.execute("""
+        INSERT INTO player_tags_keyed
+        SELECT user_id, type, tag, SUM(quantity)
+        FROM player_tags
+        GROUP BY user_id, type, tag
+        HAVING SUM(quantity) > 0
+        """)
+    cursor.execute("DROP TABLE player_tags")
+    cursor.execute("ALTER TABLE player_tags_keyed RENAME TO player_tags")
+
+    cursor.execute("""
+        CREATE TABLE quest_group_info_keyed(
+            adventure_id INTEGER NOT NULL,
+            group_id TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            message_id INTEGER,
+            PRIMARY KEY(adventure_id, group_id)
+        ) WITHOUT ROWID
+        """)
+    cursor.execute("""
+        INSERT INTO quest_group_info_keyed
+        SELECT adventure_id, group_id, SUM(count), MAX(message_id)
+        FROM quest_group_info
+        GROUP BY adventure_id, group_id
+        """)
+    cursor.execute("DROP TABLE quest_group_info")
+    cursor.execute("ALTER TABLE quest_group_info_keyed RENAME TO quest_group_info")
+
+    cursor.execute("""
+        CREATE TABLE adventure_results_keyed(
+            adventure_id INTEGER NOT NULL,
+            group_id TEXT NOT NULL,
+            quest_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY(adventure_id, group_id, quest_id, type, tag)
+        ) WITHOUT ROWID
+        """)
+    cursor.execute("""
+        INSERT INTO adventure_results_keyed
+        SELECT adventure_id, group_id, quest_id, type, tag, SUM(quantity)
+        FROM adventure_results
+        GROUP BY adventure_id, group_id, quest_id, type, tag
+        HAVING SUM(quantity) != 0
+        """)
+    cursor.execute("DROP TABLE adventure_results")
+    cursor.execute("ALTER TABLE adventure_results_keyed RENAME TO adventure_results")
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS player_adventure_user
+        ON player_adventure(user_id, last_updated DESC)
+        """)
+
+
+def add_adventure_seeds(cursor: Cursor):
+    # Existing adventures get a random seed of their own
+    cursor.execute("""
+        ALTER TABLE player_adventure
+        ADD COLUMN seed INTEGER NOT NULL DEFAULT 0
+        """)
+    cursor.execute("UPDATE player_adventure SET seed = abs(random() >> 1)")
+
+
+def add_bot_state(cursor: Cursor):
+    # Progress of one off setup steps, so they can pick up where they left off
+    cursor.execute("""
+        CREATE TABLE bot_state(
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+        """)
+    # Nobody has adventured yet, so the zone channels are set up from scratch
+    cursor.execute("""
+        INSERT INTO bot_state
+        SELECT 'zone_channels', 'reset'
+        WHERE NOT EXISTS (SELECT 1 FROM player_adventure)
+        """)
+
+
+def add_adventure_summaries(cursor: Cursor):
+    # Superseded adventures are compacted into totals per player
+    cursor.execute("""
+        CREATE TABLE adventure_summary(
+            user_id INTEGER NOT NULL,
+            zone_id TEXT NOT NULL,
+            adventures INTEGER NOT NULL,
+            last_updated INTEGER NOT NULL,
+            PRIMARY KEY(user_id, zone_id)
+        ) WITHOUT ROWID
+        """)
+    cursor.execute("""
+        CREATE TABLE quest_group_summary(
+            user_id INTEGER NOT NULL,
+            group_id TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY(user_id, group_id)
+        ) WITHOUT ROWID
+        """)
+
+
+def add_lease(cursor: Cursor):
+    # Only the process holding the lease writes to this database, so shards
+    # can't both update the same players
+    cursor.execute("""
+        CREATE TABLE lease(
+            id INTEGER PRIMARY KEY CHECK(id = 1),
+            owner TEXT NOT NULL,
+            expires REAL NOT NULL
+        )
+        """)
+
+
+# Append only, the index of each migration + 1 is the schema version it
+# leaves the database at
+MIGRATIONS: list[Callable[[Cursor], None]] = [
+    create_tables,
+    add_primary_keys,
+    add_adventure_seeds,
+    add_bot_state,
+    add_adventure_summaries,
+    add_lease,
+]
+
+
+def get_schema_version(connection: Connection) -> int:
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection: Connection):
+    version = get_schema_version(connection)
+    if version > len(MIGRATIONS):
+        raise Exception(
+            f"Database schema version {version} is newer than this build supports"
+        )
+    for new_version in range(version + 1, len(MIGRATIONS) + 1):
+        cursor = connection.cursor()
+        cursor.execute("BEGIN")
+        try:
+            MIGRATIONS[new_version - 1](cursor)
+            cursor.execute(f"PRAGMA user_version = {new_version}")
+        except Exception:
+            connection.rollback()
+            raise
+        connection.commit()
@@ -1,25 +1,60 @@
+import random
 import sqlite3
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 from sqlite3 import Cursor
 
 from game.adventure import Adventure, AdventureGroup, AdventureStep
 from game.tags import TagType, TagCollection
 from game.quests import QUESTS
+from metrics import METRICS
+
+from .migrations import migrate
 
 
 class StorageTransaction:
     def __init__(self, cursor: Cursor):
         self._cursor = cursor
         self._rollback = False
+        # Deltas are merged in memory and written in bulk on flush
+        self._tag_deltas: dict[tuple[int, str, str], int] = {}
+        self._group_counts: dict[tuple[int, str], int] = {}
+        self._result_deltas: dict[tuple[int, str, str, str, str], int] = {}
 
     def cancel(self):
         self._rollback = True
 
+    @contextmanager
+    def savepoint(self) -> Iterator["StorageTransaction"]:
+        # Lets one piece of work fail without losing the rest of a batch
+        if not self._cursor.connection.in_transaction:
+            self._cursor.execute("BEGIN")
+        self._cursor.execute("SAVEPOINT batch_item")
+        try:
+            yield self
+            self.flush()
+        except Exception:
+            self._tag_deltas.clear()
+            self._group_counts.clear()
+            self._result_deltas.clear()
+            self._cursor.execute("ROLLBACK TO batch_item")
+            raise
+        finally:
+            self._cursor.execute("RELEASE batch_item")
+
     def start_adventure(
-        self, user_id: int, zone_id: str, start_time: int, thread_id: int
+        self,
+        user_id: int,
+        zone_id: str,
+        start_time: int,
+        thread_id: int,
+        seed: int | None = None,
     ) -> Adventure:
+        if seed is None:
+            seed = random.getrandbits(63)
         self._cursor.execute(
-            "INSERT INTO player_adventure VALUES(?, ?, ?, ?, ?)",
-            (None, user_id, zone_id, start_time, thread_id),
+            "INSERT INTO player_adventure VALUES(?, ?, ?, ?, ?, ?)",
+            (None, user_id, zone_id, start_time, thread_id, seed),
         )
         if not self._cursor.lastrowid:
             raise Exception("Lost rowid for new activity")
@@ -29,6 +64,7 @@ class StorageTransaction:
             zone_id=zone_id,
             last_updated=start_time,
             thread_id=thread_id,
+            seed=seed,
         )
 
     def update_adventure(self, adventure_id: int, last_updated: int):
@@ -41,218 +77,241 @@ class StorageTransaction:
             (last_updated, adventure_id),
         )
 
-    def add_remove_tag(
-        self, user_id: int, tag_type: TagType, tag: str, quantity: int
-    ) -> bool:
+    def add_remove_tag(self, user_id: int, tag_type: TagType, tag: str, quantity: int):
         if quantity == 0:
-            return True
-        result = self._cursor.execute(
-            """
-            SELECT quantity
-            FROM player_tags
-            WHERE user_id = ? AND type = ? AND tag = ?
-            """,
-            (user_id, tag_type.value, tag),
-        )
-
-        current_quantity = result.fetchone()
-        if current_quantity is None:
-            if quantity <= 0:
-                return False
-            self._cursor.execute(
-                """INSERT INTO player_tags VALUES(?, ?, ?, ?)""",
-                (user_id, tag_type.value, tag, quantity),
-            )
-            return True
-        new_quantity = current_quantity[0] + quantity
+            return
+        key = (user_id, tag_type.value, tag)
+        self._tag_deltas[key] = self._tag_deltas.get(key, 0) + quantity
 
-        if new_quantity < 0:
-            return False
-
-        if new_quantity == 0:
-            result = self._cursor.execute(
-                """
-                DELETE FROM player_tags
-                WHERE user_id = ? AND type = ? AND tag = ?
-                """,
-                (user_id, tag_type.value, tag),
-            )
-            return True
+    def increment_or_insert_quest_group(
+        self, adventure_id: int, group_id: str, count: int = 1
+    ):
+        key = (adventure_id, group_id)
+        self._group_counts[key] = self._group_counts.get(key, 0) + count
 
+    def add_group_message(self, adventure_id: int, group_id: str, message_id: int):
+        # The group's counts may still be waiting to be written, so the row is
+        # created here if needed and the counts are added to it later
         self._cursor.execute(
             """
-            UPDATE player_tags
-            SET quantity = ?
-            WHERE user_id = ? AND type = ? AND tag = ?
+            INSERT INTO quest_group_info VALUES(?, ?, 0, ?)
+            ON CONFLICT(adventure_id, group_id)
+            DO UPDATE SET message_id = excluded.message_id
             """,
-            (
-                current_quantity[0] + quantity,
-                user_id,
-                tag_type.value,
-                tag,
-            ),
+            (adventure_id, group_id, message_id),
         )
-        return True
 
-    def increment_or_insert_quest_group(self, adventure_id: int, group_id: str):
+    def update_adventure_results(
+        self,
+        adventure_id: int,
+        group_id: str,
+        quest_id: str,
+        tag_type: TagType,
+        tag: str,
+        quantity: int,
+    ):
+        if quantity == 0:
+            return
+        key = (adventure_id, group_id, quest_id, tag_type.value, tag)
+        self._result_deltas[key] = self._result_deltas.get(key, 0) + quantity
+
+    def compact_adventures(self, before: int, limit: int) -> int:
+        # Folds up to limit adventures that were superseded by a newer one and
+        # last updated before the given time into the player's summaries.
+        # Their results are already part of the player's tags
         result = self._cursor.execute(
             """
-            SELECT count 
-            FROM quest_group_info 
-            WHERE adventure_id = ? AND group_id = ?
+            SELECT adventure_id, user_id, zone_id, last_updated
+            FROM player_adventure AS old
+            WHERE last_updated < ? AND EXISTS (
+                SELECT 1
+                FROM player_adventure AS new
+                WHERE new.user_id = old.user_id
+                AND new.last_updated > old.last_updated
+            )
+            LIMIT ?
             """,
-            (adventure_id, group_id),
+            (before, limit),
         )
-        if result.fetchone() is None:
-            self._cursor.execute(
-                """
-                INSERT INTO quest_group_info
-                VALUES(?, ?, ?, ?)
-                """,
-                (adventure_id, group_id, 1, None),
-            )
-            return
-        self._cursor.execute(
+        rows = result.fetchall()
+        self._cursor.executemany(
             """
-            UPDATE quest_group_info
-            SET count = count + 1
-            WHERE adventure_id = ? AND group_id = ?
+            INSERT INTO adventure_summary VALUES(?, ?, 1, ?)
+            ON CONFLICT(user_id, zone_id) DO UPDATE SET
+                adventures = adventures + 1,
+                last_updated = max(last_updated, excluded.last_updated)
             """,
-            (adventure_id, group_id),
+            [
+                (user_id, zone_id, last_updated)
+                for _, user_id, zone_id, last_updated in rows
+            ],
         )
-
-    def add_group_message(self, adventure_id: int, group_id: str, message_id: int):
-        result = self._cursor.execute(
+        self._cursor.executemany(
             """
-            SELECT * 
-            FROM quest_group_info 
-            WHERE adventure_id = ? AND group_id = ?
+            INSERT INTO quest_group_summary
+            SELECT ?, group_id, count
+            FROM quest_group_info
+            WHERE adventure_id = ? AND count > 0
+            ON CONFLICT(user_id, group_id) DO UPDATE SET
+                count = count + excluded.count
             """,
-            (adventure_id, group_id),
+            [(user_id, adventure_id) for adventure_id, user_id, _, _ in rows],
         )
-        if result.fetchone() is None:
-            raise Exception(
-                f"No entry found for adventure: {adventure_id}, group: {group_id}"
+        adventure_ids = [(adventure_id,) for adventure_id, _, _, _ in rows]
+        for table in ("adventure_results", "quest_group_info", "player_adventure"):
+            self._cursor.executemany(
+                f"DELETE FROM {table} WHERE adventure_id = ?", adventure_ids
             )
+        return len(rows)
+
+    def set_bot_state(self, key: str, value: str | None):
+        if value is None:
+            self._cursor.execute("DELETE FROM bot_state WHERE key = ?", (key,))
+            return
         self._cursor.execute(
             """
-            UPDATE quest_group_info
-            SET message_id = ?
-            WHERE adventure_id = ? AND group_id = ?
+            INSERT INTO bot_state VALUES(?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
             """,
-            (message_id, adventure_id, group_id),
+            (key, value),
         )
 
-    # TODO: Find a way to merge this with add_remove_tag
-    def update_adventure_results(
-        self,
-        adventure_id: int,
-        group_id: str,
-        quest_id: str,
-        tag_type: TagType,
-        tag: str,
-        quantity: int,
-    ) -> bool:
-        if quantity == 0:
-            return True
-        result = self._cursor.execute(
+    def acquire_lease(self, owner: str, current_time: float, duration: float):
+        # Taken over once it expires, renewed by the owner before then
+        self._cursor.execute(
             """
-            SELECT quantity
-            FROM adventure_results
-            WHERE 
-                adventure_id = ? AND 
-                group_id = ? AND 
-                quest_id = ? AND 
-                type = ? AND 
-                tag = ?
+            INSERT INTO lease VALUES(1, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                owner = excluded.owner,
+                expires = excluded.expires
+            WHERE lease.owner = excluded.owner OR lease.expires <= ?
             """,
-            (adventure_id, group_id, quest_id, tag_type.value, tag),
+            (owner, current_time + duration, current_time),
         )
+        self.check_lease(owner)
 
-        current_quantity = result.fetchone()
-        if current_quantity is None:
-            self._cursor.execute(
-                """INSERT INTO adventure_results VALUES(?, ?, ?, ?, ?, ?)""",
-                (adventure_id, group_id, quest_id, tag_type.value, tag, quantity),
-            )
-            return True
-        new_quantity = current_quantity[0] + quantity
+    def check_lease(self, owner: str):
+        # Takes the write lock first, so nothing in the transaction is written
+        # if another process has taken the lease over
+        if not self._cursor.connection.in_transaction:
+            self._cursor.execute("BEGIN IMMEDIATE")
+        row = self._cursor.execute("SELECT owner FROM lease").fetchone()
+        if row is None or row[0] != owner:
+            holder = "nobody" if row is None else row[0]
+            raise Exception(f"Lease is held by {holder}, not {owner}")
+
+    def release_lease(self, owner: str):
+        self._cursor.execute("DELETE FROM lease WHERE owner = ?", (owner,))
 
-        if new_quantity == 0:
+    def flush(self):
+        with METRICS.timer("storage.flush"):
+            self._flush()
+
+    def _flush(self):
+        tag_rows = [
+            (*key, quantity)
+            for key, quantity in self._tag_deltas.items()
+            if quantity != 0
+        ]
+        self._cursor.executemany(
+            """
+            INSERT INTO player_tags VALUES(?, ?, ?, ?)
+            ON CONFLICT(user_id, type, tag)
+            DO UPDATE SET quantity = quantity + excluded.quantity
+            """,
+            tag_rows,
+        )
+        # Only removals can take a tag below zero, those are refused and the
+        # whole write rolls back rather than losing the row
+        for user_id, tag_type, tag, quantity in tag_rows:
+            if quantity > 0:
+                continue
             result = self._cursor.execute(
                 """
-                DELETE FROM adventure_results
-                WHERE 
-                    adventure_id = ? AND 
-                    group_id = ? AND 
-                    quest_id = ? AND 
-                    type = ? AND 
-                    tag = ?
+                SELECT quantity
+                FROM player_tags
+                WHERE user_id = ? AND type = ? AND tag = ?
                 """,
-                (adventure_id, group_id, quest_id, tag_type.value, tag),
+                (user_id, tag_type, tag),
             )
-            return True
+            (new_quantity,) = result.fetchone()
+            if new_quantity < 0:
+                raise Exception(
+                    f"Player {user_id} would have {new_quantity} of {tag_type} {tag}"
+                )
+        self._cursor.executemany(
+            """
+            DELETE FROM player_tags
+            WHERE user_id = ? AND type = ? AND tag = ? AND quantity = 0
+            """,
+            [row[:3] for row in tag_rows if row[3] < 0],
+        )
+        self._tag_deltas.clear()
 
-        self._cursor.execute(
+        self._cursor.executemany(
             """
-            UPDATE adventure_results
-            SET quantity = ?
-            WHERE 
-                adventure_id = ? AND 
-                group_id = ? AND 
-                quest_id = ? AND 
-                type = ? AND 
-                tag = ?
+            INSERT INTO quest_group_info VALUES(?, ?, ?, NULL)
+            ON CONFLICT(adventure_id, group_id)
+            DO UPDATE SET count = count + excluded.count
+            """,
+            [(*key, count) for key, count in self._group_counts.items()],
+        )
+        self._group_counts.clear()
+
+        result_rows = [
+            (*key, quantity)
+            for key, quantity in self._result_deltas.items()
+            if quantity != 0
+        ]
+        self._cursor.executemany(
+            """
+            INSERT INTO adventure_results VALUES(?, ?, ?, ?, ?, ?)
+            ON CONFLICT(adventure_id, group_id, quest_id, type, tag)
+            DO UPDATE SET quantity = quantity + excluded.quantity
+            """,
+            result_rows,
+        )
+        self._cursor.executemany(
+            """
+            DELETE FROM adventure_results
+            WHERE
+                adventure_id = ? AND
+                group_id = ? AND
+                quest_id = ? AND
+                type = ? AND
+                tag = ? AND
+                quantity = 0
             """,
-            (new_quantity, adventure_id, group_id, quest_id, tag_type.value, tag),
+            [row[:5] for row in result_rows],
         )
-        return True
+        self._result_deltas.clear()
 
 
 class StorageModel:
-    def __init__(self):
-        self._connection = sqlite3.connect("game_data.db")
-        cursor = self._connection.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS player_adventure(
-                adventure_id INTEGER PRIMARY KEY ASC,
-                user_id INT,
-                zone_id STR,
-                last_updated INT,
-                thread_id INT
-            )
-            """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS player_tags(
-                user_id INT,
-                type STR,
-                tag STR,
-                quantity INT
-            )
-            """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS quest_group_info(
-                adventure_id INT,
-                group_id STR,
-                count INT,
-                message_id INT
-            )
-            """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS adventure_results(
-                adventure_id INT,
-                group_id STR,
-                quest_id STR,
-                type STR,
-                tag STR,
-                quantity INT
-            )
-            """)
-
-        self._connection.commit()
+    def __init__(
+        self,
+        path: str = "game_data.db",
+        read_only: bool = False,
+        statement_hook: Callable[[str], None] | None = None,
+    ):
+        if read_only:
+            self._connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        else:
+            self._connection = sqlite3.connect(path)
+        if statement_hook is not None:
+            self._connection.set_trace_callback(statement_hook)
+        if not read_only:
+            migrate(self._connection)
         self._transaction: StorageTransaction | None = None
         self._open_transactions: int = 0
 
+    def enable_wal(self):
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+    def close(self):
+        self._connection.close()
+
     def __enter__(self) -> StorageTransaction:
         if not self._transaction:
             self._transaction = StorageTransaction(self._connection.cursor())
@@ -265,6 +324,13 @@ class StorageModel:
             if self._transaction and self._transaction._rollback:  # type: ignore
                 self._connection.rollback()
             else:
+                try:
+                    if self._transaction:
+                        self._transaction.flush()
+                except Exception:
+                    self._connection.rollback()
+                    self._transaction = None
+                    raise
                 self._connection.commit()
             self._transaction = None
 
@@ -276,21 +342,54 @@ class StorageModel:
             FROM player_adventure
             WHERE user_id = ?
             ORDER BY last_updated DESC
+            LIMIT 1
             """,
             (user_id,),
         )
         row = result.fetchone()
         if row is None:
             return None
-        adventure_id, user_id, zone_id, last_updated, thread_id = row
+        adventure_id, user_id, zone_id, last_updated, thread_id, seed = row
         return Adventure(
             adventure_id=adventure_id,
             user_id=user_id,
             zone_id=zone_id,
             last_updated=last_updated,
             thread_id=thread_id,
+            seed=seed,
         )
 
+    def get_bot_state(self, key: str) -> str | None:
+        cursor = self._connection.cursor()
+        result = cursor.execute("SELECT value FROM bot_state WHERE key = ?", (key,))
+        row = result.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def get_active_content_ids(self) -> tuple[set[str], set[str]]:
+        # Zones of everyone's current adventure and the quests in the groups
+        # already recorded for them
+        cursor = self._connection.cursor()
+        current_adventures = """
+            SELECT adventure_id, zone_id, MAX(last_updated)
+            FROM player_adventure
+            GROUP BY user_id
+            """
+        result = cursor.execute(current_adventures)
+        zone_ids = {zone_id for _, zone_id, _ in result.fetchall()}
+        result = cursor.execute(f"""
+            SELECT DISTINCT group_id
+            FROM quest_group_info
+            WHERE adventure_id IN (
+                SELECT adventure_id FROM ({current_adventures})
+            )
+            """)
+        quest_ids: set[str] = set()
+        for (group_id,) in result.fetchall():
+            quest_ids.update(group_id.split(","))
+        return zone_ids, quest_ids
+
     def get_player_tags(self, user_id: int) -> TagCollection:
         cursor = self._connection.cursor()
         result = cursor.execute(